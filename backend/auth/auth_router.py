@@ -1,24 +1,49 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-from database import get_db
+from database import get_db, run_db
 from models.user_model import User
-from utils.hashing import verify_password, get_password_hash
+from utils.hashing import hash_password_async, verify_and_update_async, verify_password_async
 from auth.auth_schema import LoginRequest, TokenResponse
-from auth.jwt_handler import create_access_token
+from auth.jwt_handler import create_access_token, user_claims
 from auth.dependencies import get_current_user
+from services.candidate_index import candidate_index
+from services.principal_cache import principal_cache
+from services.session_store import session_store
+from typing import Optional
 from pydantic import BaseModel, EmailStr, validator
 from datetime import date
-from auth.auth_schema import ChangePasswordRequest  
+import asyncio
+from auth.auth_schema import ChangePasswordRequest, RefreshRequest, LogoutRequest
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+# ==========================================
+# 🧵 TRUY VẤN DB (chạy qua run_db; bcrypt chạy trên pool riêng trong utils.hashing)
+# ==========================================
+def _find_user(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def _issue_tokens(db: Session, user: User, new_hash) -> dict:
+    """Lưu hash mới (nếu cần băm lại), tạo access + refresh token"""
+    claims = user_claims(user)
+    user_id = user.user_id
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+    return {
+        "access_token": create_access_token(claims),
+        "token_type": "bearer",
+        "refresh_token": session_store.create(user_id),
+    }
+
+
 # ==========================================
 # 🔑 LOGIN
 # ==========================================
 @router.post("/login", response_model=TokenResponse)
-def login_user(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request.email).first()
+async def login_user(request: LoginRequest, db: Session = Depends(get_db)):
+    user = await run_db(_find_user, db, request.email)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email hoặc mật khẩu không đúng")
 
@@ -29,7 +54,9 @@ def login_user(request: LoginRequest, db: Session = Depends(get_db)):
             detail="Tài khoản của bạn đã bị khóa bởi admin."
         )
 
-    if not verify_password(request.password, user.password_hash):
+    # Hash cũ khác BCRYPT_ROUNDS → new_hash là bản băm lại, lưu luôn
+    valid, new_hash = await verify_and_update_async(request.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email hoặc mật khẩu không đúng")
 
     # ❌ CHẶN ADMIN LOGIN TẠI ROUTE USER
@@ -39,19 +66,9 @@ def login_user(request: LoginRequest, db: Session = Depends(get_db)):
             detail="Tài khoản Admin không được đăng nhập ở đây. Vui lòng truy cập /admin/login"
         )
 
-    # Cập nhật trạng thái online
-    db.execute(
-        text("UPDATE users SET is_online = 1 WHERE user_id = :uid"),
-        {"uid": user.user_id},
-    )
-    db.commit()
-
-    # Trả token user
-    access_token = create_access_token({"sub": user.email})
-    return {
-        "access_token": access_token,
-        "token_type": "bearer"
-    }
+    # Trả token user (+ refresh token để gia hạn không cần đăng nhập lại)
+    # (Trạng thái online do services.presence theo dõi qua WebSocket, không ghi users nữa)
+    return await run_db(_issue_tokens, db, user, new_hash)
 
 
 
@@ -77,14 +94,8 @@ class RegisterRequest(BaseModel):
             )
         return v
 
-@router.post("/register")
-def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == request.email).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Email đã được sử dụng")
-
-    hashed_pw = get_password_hash(request.password)
 
+def _create_user(db: Session, request: RegisterRequest, hashed_pw: str) -> int:
     new_user = User(
         email=request.email,
         password_hash=hashed_pw,
@@ -101,21 +112,34 @@ def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    candidate_index.upsert_user(new_user)
+    return new_user.user_id
+
 
-    return {"message": "✅ Đăng ký thành công", "user_id": new_user.user_id}
+@router.post("/register")
+async def register_user(request: RegisterRequest, db: Session = Depends(get_db)):
+    existing = await run_db(_find_user, db, request.email)
+    if existing:
+        raise HTTPException(status_code=400, detail="Email đã được sử dụng")
+
+    hashed_pw = await hash_password_async(request.password)
+    user_id = await run_db(_create_user, db, request, hashed_pw)
+
+    return {"message": "✅ Đăng ký thành công", "user_id": user_id}
 
 
 # ==========================================
 # 🔐 ADMIN LOGIN (route riêng cho Admin)
 # ==========================================
 @router.post("/admin/login", response_model=TokenResponse)
-def admin_login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == request.email).first()
+async def admin_login(request: LoginRequest, db: Session = Depends(get_db)):
+    user = await run_db(_find_user, db, request.email)
 
     if not user:
         raise HTTPException(status_code=401, detail="Email hoặc mật khẩu không đúng")
 
-    if not verify_password(request.password, user.password_hash):
+    valid, new_hash = await verify_and_update_async(request.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Email hoặc mật khẩu không đúng")
 
     # ❗ Chỉ admin mới được login
@@ -123,9 +147,31 @@ def admin_login(request: LoginRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=403, detail="Bạn không có quyền Admin")
 
     # Tạo token admin
-    access_token = create_access_token({"sub": user.email, "role": "admin"})
+    return await run_db(_issue_tokens, db, user, new_hash)
+
+
+# ==========================================
+# 🔄 REFRESH TOKEN
+# ==========================================
+@router.post("/refresh", response_model=TokenResponse)
+def refresh_token(data: RefreshRequest, db: Session = Depends(get_db)):
+    rotated = session_store.rotate(data.refresh_token)
+    if rotated is None:
+        raise HTTPException(status_code=401, detail="Phiên đăng nhập đã hết hạn, vui lòng đăng nhập lại")
+    user_id, new_refresh = rotated
+
+    user = principal_cache.get_by_id(db, user_id)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Phiên đăng nhập đã hết hạn, vui lòng đăng nhập lại")
+    if user.is_banned:
+        session_store.revoke_user(user_id)
+        raise HTTPException(status_code=403, detail="Tài khoản của bạn đã bị khóa bởi admin.")
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {
+        "access_token": create_access_token(user_claims(user)),
+        "token_type": "bearer",
+        "refresh_token": new_refresh,
+    }
 
 @router.get("/admin/me")
 def admin_me(current_user: User = Depends(get_current_user)):
@@ -138,12 +184,13 @@ def admin_me(current_user: User = Depends(get_current_user)):
 # 🚪 LOGOUT
 # ==========================================
 @router.post("/logout")
-def logout_user(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db.execute(
-        text("UPDATE users SET is_online = 0 WHERE user_id = :uid"),
-        {"uid": current_user.user_id},
-    )
-    db.commit()
+def logout_user(
+    data: Optional[LogoutRequest] = None,
+    current_user: User = Depends(get_current_user),
+):
+    # Offline khi đóng hết WebSocket (services.presence), không cần ghi users
+    if data and data.refresh_token:
+        session_store.revoke(data.refresh_token)
     return {"message": "👋 Đăng xuất thành công!"}
 
 
@@ -152,33 +199,54 @@ def logout_user(current_user: User = Depends(get_current_user), db: Session = De
 # ==========================================
 
 
+def _save_password(db: Session, user: User, new_hashed: str) -> dict:
+    """Lưu hash mới; trả claim của token (đọc trước commit → không lazy-load trên event loop)"""
+    claims = user_claims(user)
+    db.query(User).filter(User.user_id == user.user_id).update({"password_hash": new_hashed})
+    db.commit()
+    return claims
+
+
 @router.post("/change-password")
-def change_password(
+async def change_password(
     data: ChangePasswordRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
+    user = await run_db(db.get, User, current_user.user_id)
+
+    # 1 + 2. Kiểm tra mật khẩu cũ / mới trùng cũ (2 lần bcrypt chạy song song trên pool)
+    old_ok, same_as_old = await asyncio.gather(
+        verify_password_async(data.old_password, user.password_hash),
+        verify_password_async(data.new_password, user.password_hash),
+    )
 
     # 1. Kiểm tra mật khẩu cũ
-    if not verify_password(data.old_password, current_user.password_hash):
+    if not old_ok:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Mật khẩu cũ không đúng"
         )
 
     # 2. Không cho phép trùng mật khẩu cũ
-    if verify_password(data.new_password, current_user.password_hash):
+    if same_as_old:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Mật khẩu mới không được trùng mật khẩu cũ"
         )
 
     # 3. Hash mật khẩu mới
-    new_hashed = get_password_hash(data.new_password)
-    current_user.password_hash = new_hashed
+    new_hashed = await hash_password_async(data.new_password)
+    claims = await run_db(_save_password, db, user, new_hashed)
 
-    db.add(current_user)
-    db.commit()
+    # 4. Thu hồi mọi refresh token cũ (thiết bị khác phải đăng nhập lại), cấp phiên mới cho thiết bị này
+    await run_db(session_store.revoke_user, current_user.user_id)
+    refresh = await run_db(session_store.create, current_user.user_id)
 
-    return {"message": "Đổi mật khẩu thành công 🎉"}
+    return {
+        "message": "Đổi mật khẩu thành công 🎉",
+        "access_token": create_access_token(claims),
+        "token_type": "bearer",
+        "refresh_token": refresh,
+    }
 
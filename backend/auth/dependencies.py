@@ -5,10 +5,13 @@ from sqlalchemy.orm import Session
 from database import get_db
 from models.user_model import User
 from auth.jwt_handler import SECRET_KEY, ALGORITHM
+from services.principal_cache import principal_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 # 1. Hàm lấy user hiện tại (User thường)
+# Trả về Principal (user_id, full_name, gender, role, ...) lấy từ cache thay vì query users mỗi request;
+# API nào cần sửa bản ghi users thì tự query User theo current_user.user_id
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -18,27 +21,19 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
 
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+        if payload.get("uid") is None and payload.get("sub") is None:
             raise credentials_exception
     except JWTError:
-        # Nếu token lỗi/hết hạn -> Set user offline (Logic cũ của bạn)
-        try:
-            decoded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
-            email = decoded.get("sub")
-            if email:
-                db.query(User).filter(User.email == email).update({"is_online": 0})
-                db.commit()
-        except Exception:
-            pass
+        # Token lỗi/hết hạn → chỉ trả 401 (không ghi DB); client gọi POST /auth/refresh để lấy token mới
         raise credentials_exception
 
-    user = db.query(User).filter(User.email == email).first()
+    # Token mới có uid → tra theo khoá chính (thường trúng cache); token cũ chỉ có email
+    user = principal_cache.resolve(db, payload)
     if user is None:
         raise credentials_exception
 
     # 🚫🚫🚫 CHẶN USER ĐÃ BỊ BAN — THÊM PHẦN NÀY 🚫🚫🚫
-    if getattr(user, "is_banned", 0) == 1:
+    if user.is_banned:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Tài khoản của bạn đã bị khóa bởi admin."
@@ -12,6 +12,11 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def user_claims(user) -> dict:
+    """Claim chuẩn của token: sub=email (giữ cho client/token cũ), uid để tra theo khoá chính.
+    Quyền (role/is_admin) luôn đọc từ principal trong cache, không để trong token."""
+    return {"sub": user.email, "uid": user.user_id}
+
 def verify_access_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
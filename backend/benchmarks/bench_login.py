@@ -0,0 +1,45 @@
+"""
+Benchmark số lần kiểm tra mật khẩu (≈ số lần đăng nhập) mỗi giây theo độ khó bcrypt
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_login
+"""
+import asyncio
+import time
+
+from passlib.context import CryptContext
+
+from utils import hashing
+
+ROUNDS = [10, 11, 12]
+LOGINS = 64
+PASSWORD = "MatKhau@123"
+
+
+def _single_core(ctx: CryptContext, hashed: str) -> float:
+    n = max(LOGINS // 8, 4)
+    start = time.perf_counter()
+    for _ in range(n):
+        ctx.verify(PASSWORD, hashed)
+    return n / (time.perf_counter() - start)
+
+
+async def _pool(hashed: str) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(hashing._run(hashing.pwd_context.verify, PASSWORD, hashed) for _ in range(LOGINS)))
+    return LOGINS / (time.perf_counter() - start)
+
+
+def main():
+    print(f"HASH_WORKERS = {hashing.HASH_WORKERS}")
+    print(f"{'rounds':>6} | {'1 core (lần/s)':>14} | {'pool (lần/s)':>12} | {'ms / lần':>8}")
+    for rounds in ROUNDS:
+        ctx = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        hashed = ctx.hash(PASSWORD)
+        per_core = _single_core(ctx, hashed)
+        pooled = asyncio.run(_pool(hashed))
+        print(f"{rounds:>6} | {per_core:>14.1f} | {pooled:>12.1f} | {1000 / per_core:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Micro-benchmark cho services.compat_scoring
+
+Chạy từ thư mục backend:
+    python -m benchmarks.bench_scoring
+"""
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from services.candidate_index import CandidateProfile
+from services.compat_scoring import rank_candidates
+
+CITIES = ["ha noi", "ho chi minh", "da nang", "hue", "can tho", "hai phong"]
+INTERESTS = [f"so thich {i}" for i in range(120)]
+SIZES = [500, 1_000, 3_000, 5_000, 10_000]
+REPEAT = 20
+
+
+def _profile(user_id: int) -> CandidateProfile:
+    return CandidateProfile(
+        user_id=user_id,
+        gender=random.choice(["male", "female", "other"]),
+        birthday=date(1970, 1, 1) + timedelta(days=random.randint(0, 35 * 365)),
+        city=random.choice(CITIES),
+        interests=set(random.sample(INTERESTS, random.randint(0, 6))),
+        updated_at=datetime.now() - timedelta(seconds=random.randint(0, 60 * 24 * 3600)),
+    )
+
+
+def main():
+    random.seed(42)
+    me = _profile(0)
+    print(f"{'ứng viên':>10} | {'trung bình (ms)':>16} | {'p95 (ms)':>9}")
+    for n in SIZES:
+        candidates = [_profile(i) for i in range(1, n + 1)]
+        rank_candidates(me, candidates)  # khởi động (nạp từ điển sở thích)
+
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            rank_candidates(me, candidates)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        avg = sum(timings) / len(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"{n:>10} | {avg:>16.2f} | {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
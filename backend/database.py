@@ -1,3 +1,8 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -14,3 +19,49 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ===============================
+# 🧵 CHẠY TRUY VẤN ĐỒNG BỘ TỪ CODE ASYNC (WebSocket)
+# ===============================
+# Driver MySQL là đồng bộ → gọi thẳng trong async def sẽ chặn event loop (mọi socket của worker).
+# Đẩy sang thread pool riêng, giới hạn số truy vấn chạy song song (≤ pool kết nối của engine: 5 + 10).
+DB_WORKERS = int(os.getenv("DB_WORKERS", "10"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Chạy fn(*args, **kwargs) (có dùng Session) trên thread pool DB và chờ kết quả.
+    Session không an toàn đa luồng: mỗi handler phải await xong lần gọi trước rồi mới gọi tiếp.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _with_session(fn, *args, **kwargs):
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def run_in_session(fn, *args, **kwargs):
+    """
+    Như run_db nhưng tự mở Session mới cho đúng 1 đơn vị công việc: fn(db, *args, **kwargs).
+    Dùng cho WebSocket sống lâu: kết nối DB chỉ bị giữ trong lúc truy vấn, socket rảnh không chiếm pool.
+    """
+    return await run_db(_with_session, fn, *args, **kwargs)
+
+
+def pool_status() -> dict:
+    """Số kết nối của pool engine (đang dùng / rảnh / vượt mức) + số thread DB cho WebSocket"""
+    pool = engine.pool
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "db_workers": DB_WORKERS,
+    }
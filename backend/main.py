@@ -1,6 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import Base, engine
+from utils.db_schema import upgrade_schema
+from services.notification_compaction import compaction_loop
+from services.broker import RedisBroker, broker
+from services import write_behind
+from services.presence import presence, presence_flush_loop, presence_sync_loop
+import asyncio
 
 
 # Import các router
@@ -12,13 +18,13 @@ from routers import (
     match_router, 
     message_router,
     event_router,
-    
+    counter_router,
 )
 
 from routers import admin_router
 from auth import auth_router
 from fastapi.staticfiles import StaticFiles
-from websocket import message_ws, call_ws, event_chat_ws
+from websocket import message_ws, call_ws, event_chat_ws, counter_ws
 
 
 app = FastAPI(title="LoveConnect API ❤️")
@@ -36,6 +42,24 @@ app.add_middleware(
 
 # ✅ Khởi tạo database
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
+
+# ✅ Job nền: gộp / xoá thông báo cũ
+@app.on_event("startup")
+async def start_background_jobs():
+    app.state.compaction_task = asyncio.create_task(compaction_loop())
+    app.state.presence_task = asyncio.create_task(presence_flush_loop())
+    app.state.presence_sync_task = asyncio.create_task(presence_sync_loop())
+
+
+@app.on_event("shutdown")
+async def close_broker():
+    # Ghi nốt tin chat còn trong bộ đệm ghi sau (CHAT_WRITE_BEHIND=1) trước khi tắt
+    await write_behind.flush_all()
+    await asyncio.to_thread(presence.flush)  # Ghi nốt last_seen
+    if isinstance(broker, RedisBroker):
+        await presence.leave_cluster(broker.client)
+    await broker.close()
 
 # ✅ Gắn các router
 app.include_router(user_router.router)
@@ -47,11 +71,13 @@ app.include_router(match_router.router)
 app.include_router(message_router.router)
 app.include_router(admin_router.router)
 app.include_router(event_router.router)
+app.include_router(counter_router.router)
 
 # ✅ WebSocket Routers
 app.include_router(message_ws.router)
 app.include_router(call_ws.router)
 app.include_router(event_chat_ws.router)
+app.include_router(counter_ws.router)
 
 # ✅ Mount thư mục uploads để xem được ảnh
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
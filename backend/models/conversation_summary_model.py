@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from sqlalchemy.sql import func
+from database import Base
+
+class ConversationSummary(Base):
+    """1 dòng cho mỗi (match, user): tin nhắn cuối + số tin chưa đọc của user đó"""
+    __tablename__ = "conversation_summaries"
+
+    match_id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    partner_id = Column(Integer, nullable=False)
+
+    last_message = Column(String(255))           # Bản xem trước (đã cắt ngắn)
+    last_message_type = Column(String(20))
+    last_sender_id = Column(Integer)
+    last_message_time = Column(DateTime)
+    unread_count = Column(Integer, nullable=False, default=0)
+
+    # = last_message_time, hoặc thời điểm match nếu chưa nhắn → khóa sắp xếp inbox
+    last_activity_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        # Keyset: WHERE user_id = ? ORDER BY last_activity_at DESC, match_id DESC
+        Index("ix_summary_user_activity", "user_id", "last_activity_at", "match_id"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -10,4 +10,9 @@ class EventMessage(Base):
     sender_id = Column(Integer, ForeignKey("users.user_id"))
     content = Column(Text)
     type = Column(String(10), default="text")
-    created_at = Column(DateTime, server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        # Lịch sử theo trang / since: WHERE event_id = ? AND id < ? (hoặc > ?)
+        Index("ix_event_messages_event_id_id", "event_id", "id"),
+    )
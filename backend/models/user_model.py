@@ -22,7 +22,8 @@ class User(Base):
     city = Column(String(100))
     bio = Column(Text)
     height = Column(String(10))
-    is_online = Column(Boolean, default=False)
+    is_online = Column(Boolean, default=False)  # Không còn ghi: trạng thái online lấy từ services.presence
+    last_seen_at = Column(DateTime, nullable=True)  # Ghi theo lô từ services.presence
 
     # ⭐️ Thêm 2 trường quản trị
     is_admin = Column(Boolean, default=False)
@@ -2,9 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
-from database import get_db
+from database import get_db, pool_status
 from auth.dependencies import get_current_user
 from models.user_model import User
+from services import conversation_summary
+from services.candidate_index import candidate_index
+from services.notification_compaction import compact_notifications
+from services.random_match import matchmaking_queue
+from services.principal_cache import principal_cache
+from services.session_store import session_store
+from services.presence import presence
+from services.exclusion_index import exclusion_index
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
@@ -30,8 +38,8 @@ def admin_stats(db: Session = Depends(get_db), user: User = Depends(get_current_
     # Tổng Users
     total_users = db.execute(text("SELECT COUNT(*) FROM users")).scalar()
 
-    # User online
-    online = db.execute(text("SELECT COUNT(*) FROM users WHERE is_online = 1")).scalar()
+    # User online (services.presence: đếm trong RAM, nhiều worker thì gộp qua Redis; không quét bảng users)
+    online = presence.online_count()
 
     # User bị ban
     banned = db.execute(text("SELECT COUNT(*) FROM users WHERE is_banned = 1")).scalar()
@@ -102,7 +110,7 @@ def admin_users(
     # Nếu có search
     if search:
         sql = text("""
-            SELECT user_id, full_name, email, gender, is_banned, is_online, created_at
+            SELECT user_id, full_name, email, gender, is_banned, last_seen_at, created_at
             FROM users
             WHERE is_admin = 0 
               AND (full_name LIKE :kw OR email LIKE :kw)
@@ -113,14 +121,14 @@ def admin_users(
     # Nếu không có search
     else:
         sql = text("""
-            SELECT user_id, full_name, email, gender, is_banned, is_online, created_at
+            SELECT user_id, full_name, email, gender, is_banned, last_seen_at, created_at
             FROM users
             WHERE is_admin = 0
             ORDER BY user_id DESC
         """)
         data = db.execute(sql).fetchall()
 
-    return [dict(r._mapping) for r in data]
+    return [{**r._mapping, "is_online": presence.is_online(r.user_id)} for r in data]
 
 
 
@@ -138,6 +146,8 @@ def ban_user(uid: int, db: Session = Depends(get_db), user: User = Depends(get_c
         {"uid": uid}
     )
     db.commit()
+    principal_cache.invalidate(uid)
+    session_store.revoke_user(uid)  # Không cho gia hạn token nữa
 
     return {"message": "Đã khóa tài khoản"}
 
@@ -154,9 +164,49 @@ def unban_user(uid: int, db: Session = Depends(get_db), user: User = Depends(get
         {"uid": uid}
     )
     db.commit()
+    principal_cache.invalidate(uid)
 
     return {"message": "Đã mở khóa tài khoản"}
 
+# ============================
+# THỐNG KÊ EXCLUSION INDEX (RAM)
+# ============================
+@router.get("/exclusion-index/stats")
+def exclusion_index_stats(user: User = Depends(get_current_user)):
+    require_admin(user)
+    return exclusion_index.stats()
+
+
+# ============================
+# THỐNG KÊ CANDIDATE INDEX (RAM)
+# ============================
+@router.get("/candidate-index/stats")
+def candidate_index_stats(user: User = Depends(get_current_user)):
+    require_admin(user)
+    return candidate_index.stats()
+
+
+@router.post("/notifications/compact")
+def compact_notifications_now(user: User = Depends(get_current_user)):
+    require_admin(user)
+    return compact_notifications()
+
+
+@router.get("/match-queue/stats")
+def match_queue_stats(user: User = Depends(get_current_user)):
+    require_admin(user)
+    return matchmaking_queue.stats()
+
+
+# ============================
+# 🔌 TÌNH TRẠNG POOL KẾT NỐI DB
+# ============================
+@router.get("/db-pool")
+def db_pool_stats(user: User = Depends(get_current_user)):
+    require_admin(user)
+    return pool_status()
+
+
 # ============================
 # TOP 10 USERS GỬI TIN NHẮN NHIỀU NHẤT
 # ============================
@@ -275,10 +325,18 @@ def admin_messages(
 def delete_message(mid: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     require_admin(user)
 
+    msg = db.execute(
+        text("SELECT match_id FROM messages WHERE message_id = :mid"),
+        {"mid": mid}
+    ).fetchone()
+
     db.execute(
         text("DELETE FROM messages WHERE message_id = :mid"),
         {"mid": mid}
     )
+    # Tin bị xoá có thể là tin cuối → dựng lại tóm tắt inbox của match
+    if msg:
+        conversation_summary.refresh_match(db, msg.match_id)
     db.commit()
 
     return {"message": "Đã xóa tin nhắn"}
@@ -310,6 +368,7 @@ def delete_match(mid: int, db: Session = Depends(get_db), user: User = Depends(g
         text("DELETE FROM matches WHERE match_id = :id"),
         {"id": mid}
     )
+    conversation_summary.delete_match(db, mid)
 
     db.commit()
     return {"message": "Xóa match thành công"}
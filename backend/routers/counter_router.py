@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from database import get_db
+from models.user_model import User
+from auth.dependencies import get_current_user
+from services.unread_counters import unread_counters
+
+router = APIRouter(prefix="/counters", tags=["Counters"])
+
+# 🔴 Số chưa đọc cho badge (không cần tải lại toàn bộ thông báo)
+@router.get("/")
+def get_counters(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return unread_counters.get(db, current_user.user_id)
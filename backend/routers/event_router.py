@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from typing import Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from database import get_db
 from models.event_model import Event
 from models.user_model import User
 from auth.dependencies import get_current_user, get_current_admin
+from services import event_chat_history
 import shutil
 import os
 import uuid
@@ -154,8 +156,18 @@ def get_participants(event_id: int, db: Session = Depends(get_db), current_user:
     return [dict(u._mapping) for u in users]
 
 # 8. Lấy lịch sử tin nhắn của sự kiện
+# - Không tham số: toàn bộ như cũ
+# - ?limit=50[&before=<id>]: trang mới nhất / cũ hơn (index (event_id, id))
+# - ?since=<id>: chỉ các tin sau id (client gọi lại khi kết nối lại; còn tin → gọi tiếp với since=next_since)
 @router.get("/{event_id}/messages")
-def get_event_messages(event_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def get_event_messages(
+    event_id: int,
+    before: Optional[int] = None,
+    since: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=event_chat_history.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
     # 1. Check quyền: Phải tham gia hoặc là Admin mới được xem
     if current_user.role != 'admin':
         is_joined = db.execute(text("SELECT 1 FROM event_participants WHERE event_id=:eid AND user_id=:uid"), 
@@ -163,23 +175,17 @@ def get_event_messages(event_id: int, db: Session = Depends(get_db), current_use
         if not is_joined:
             raise HTTPException(status_code=403, detail="Bạn chưa tham gia sự kiện này")
 
-    # 2. Query tin nhắn + Join bảng users để lấy tên người gửi
-    sql = text("""
-        SELECT m.content, m.created_at, m.sender_id, u.full_name as sender_name
-        FROM event_messages m
-        JOIN users u ON m.sender_id = u.user_id
-        WHERE m.event_id = :eid
-        ORDER BY m.created_at ASC
-    """)
-    
-    msgs = db.execute(sql, {"eid": event_id}).fetchall()
-    
-    # 3. Format dữ liệu trả về (giống format WebSocket)
-    return [{
-        "content": m.content,
-        "sender_id": m.sender_id,
-        "sender_name": m.sender_name,
-        # Format thời gian thành HH:MM (hoặc giữ nguyên tùy bạn)
-        "created_at": m.created_at.strftime("%H:%M") if m.created_at else "",
-        "is_me": m.sender_id == current_user.user_id
-    } for m in msgs]
\ No newline at end of file
+    uid = current_user.user_id
+    page_size = limit or event_chat_history.DEFAULT_PAGE_SIZE
+
+    if since is not None:
+        rows, has_more = event_chat_history.fetch_since(db, event_id, since, page_size)
+        return event_chat_history.page_response(rows, has_more, uid, since=True)
+
+    if limit is not None or before is not None:
+        rows, has_more = event_chat_history.fetch_before(db, event_id, before, page_size)
+        return event_chat_history.page_response(rows, has_more, uid)
+
+    # 2. Toàn bộ lịch sử (format giống WebSocket)
+    msgs = event_chat_history.fetch_all(db, event_id)
+    return [event_chat_history.format_message(m, uid) for m in msgs]
\ No newline at end of file
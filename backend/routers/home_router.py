@@ -1,24 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from database import get_db
 from models.user_model import User
 from auth.dependencies import get_current_user
 from datetime import date
+from pydantic import BaseModel, Field
+from typing import List, Literal
+from services.recommendation_deck import DeckFilters, deck_store, fetch_card, fetch_cards
+from services.exclusion_index import exclusion_index
+from services.like_pipeline import record_like, record_swipes
 
 router = APIRouter(prefix="/home", tags=["Home"])
 
-# ✅ API: Lấy người gợi ý (có hỗ trợ bộ lọc)
-@router.get("/recommendations")
-def get_recommendations(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
-    gender: str = Query(None),
-    min_age: int = Query(18),
-    max_age: int = Query(60),
-    city: str = Query(None),
-    interest: str = Query(None),
-):
+MAX_SWIPES_PER_BATCH = 200
+
+
+class SwipeItem(BaseModel):
+    target_id: int
+    action: Literal["like", "skip"]
+
+
+class SwipeBatchRequest(BaseModel):
+    swipes: List[SwipeItem] = Field(..., max_length=MAX_SWIPES_PER_BATCH)
+
+
+# ✅ Chuyển bộ lọc query → DeckFilters (dùng chung cho gợi ý đơn và theo trang)
+def _parse_filters(gender, min_age, max_age, city, interest, ranked=False) -> DeckFilters:
     today = date.today()
 
     # ✅ Giới hạn tuổi an toàn
@@ -33,71 +41,104 @@ def get_recommendations(
     min_birth = today.replace(year=today.year - max_age)
     max_birth = today.replace(year=today.year - min_age)
 
-    where_clauses = [
-    "u.user_id != :uid",
-    "u.is_admin = 0", 
-    "u.user_id NOT IN (SELECT to_user_id FROM likes WHERE from_user_id = :uid)",
-    "u.user_id NOT IN (SELECT target_user_id FROM skips WHERE user_id = :uid)",
-    "u.user_id NOT IN (SELECT user1_id FROM matches WHERE user2_id = :uid UNION SELECT user2_id FROM matches WHERE user1_id = :uid)",
-    "u.birthday BETWEEN :min_birth AND :max_birth",
-]
-
-    params = {"uid": current_user.user_id, "min_birth": min_birth, "max_birth": max_birth}
-
-    if gender:
-        where_clauses.append("u.gender = :gender")
-        params["gender"] = gender
-
-    if city:
-        where_clauses.append("u.city LIKE :city")
-        params["city"] = f"%{city}%"
-
-    if interest:
-        where_clauses.append("""
-            u.user_id IN (
-                SELECT ui.user_id FROM user_interests ui
-                JOIN interests i ON i.interest_id = ui.interest_id
-                WHERE i.name LIKE :interest
-            )
-        """)
-        params["interest"] = f"%{interest}%"
-
-    where_sql = " AND ".join(where_clauses)
-
-    # ✅ Tổng số người phù hợp
-    total_sql = text(f"""
-        SELECT COUNT(*) as total
-        FROM users u
-        WHERE {where_sql}
-    """)
-    total_result = db.execute(total_sql, params).fetchone()
-    total = total_result.total if total_result else 0
-
-    # ✅ Lấy 1 người ngẫu nhiên phù hợp
-    sql = text(f"""
-        SELECT u.user_id, u.full_name, u.gender, u.city, u.bio, u.birthday, 
-               p.url AS avatar_url
-        FROM users u
-        LEFT JOIN photos p ON u.user_id = p.user_id AND p.is_avatar = 1
-        WHERE {where_sql}
-        ORDER BY RAND()
-        LIMIT 1
-    """)
-    result = db.execute(sql, params).fetchone()
+    return DeckFilters(
+        gender=gender or None,
+        min_birth=min_birth,
+        max_birth=max_birth,
+        city=city or None,
+        interest=interest or None,
+        ranked=ranked,
+    )
+
+
+# ✅ API: Lấy người gợi ý (có hỗ trợ bộ lọc)
+# Phát lá bài từ deck đã xáo trộn sẵn của user thay vì ORDER BY RAND() mỗi lần quẹt
+# ?ranked=true → sắp theo điểm tương hợp (sở thích chung, tuổi, thành phố, hoạt động)
+@router.get("/recommendations")
+def get_recommendations(
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    gender: str = Query(None),
+    min_age: int = Query(18),
+    max_age: int = Query(60),
+    city: str = Query(None),
+    interest: str = Query(None),
+    ranked: bool = Query(False),
+):
+    filters = _parse_filters(gender, min_age, max_age, city, interest, ranked)
+    uid = current_user.user_id
+
+    # ✅ Lấy 1 người từ deck (bỏ qua ID không còn tồn tại)
+    deck = deck_store.get_or_build(db, uid, filters)
+    result = None
+    while result is None:
+        candidate_id = deck_store.take(deck)
+        if candidate_id is None:
+            if deck.exhausted:
+                break
+            # Deck tạm rỗng (lượt nạp background chưa xong) → nạp ngay thay vì báo 404 sai
+            deck_store.refill_now(db, uid, filters, deck, want=1)
+            continue
+        result = fetch_card(db, candidate_id)
+
+    # ✅ Deck sắp hết → nạp thêm ở background
+    if deck_store.needs_refill(deck):
+        background_tasks.add_task(deck_store.refill, uid, filters)
 
     if not result:
         raise HTTPException(status_code=404, detail="Không còn người nào phù hợp!")
 
-    # ✅ Đếm đã xem (đã skip)
-    seen_sql = text("SELECT COUNT(*) as seen FROM skips WHERE user_id = :uid")
-    seen_result = db.execute(seen_sql, {"uid": current_user.user_id}).fetchone()
-    seen = seen_result.seen if seen_result else 0
-    index = min(seen + 1, total) if total > 0 else 0
+    total = deck.total
+    index = min(deck.seen + deck.served, total) if total > 0 else 0
 
     # ✅ Trả kết quả
     user_data = dict(result._mapping)
     return {"user": user_data, "total": total, "index": index}
 
+
+# ✅ API: Lấy nhiều người gợi ý 1 lần (client prefetch cả chồng bài)
+# Gửi lại cùng cursor → nhận lại đúng trang đó; dùng next_cursor để lấy trang sau
+@router.get("/recommendations/batch")
+def get_recommendations_batch(
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: str = Query(None),
+    gender: str = Query(None),
+    min_age: int = Query(18),
+    max_age: int = Query(60),
+    city: str = Query(None),
+    interest: str = Query(None),
+    ranked: bool = Query(False),
+):
+    filters = _parse_filters(gender, min_age, max_age, city, interest, ranked)
+    uid = current_user.user_id
+
+    deck = deck_store.get_or_build(db, uid, filters)
+
+    # ✅ Deck không đủ 1 trang → nạp ngay để trả đủ trong 1 round trip
+    if deck.remaining() < limit and not deck.exhausted:
+        deck_store.refill_now(db, uid, filters, deck, want=limit)
+
+    page_ids = deck_store.take_page(deck, cursor, limit)
+    users = fetch_cards(db, page_ids)
+
+    if deck_store.needs_refill(deck):
+        background_tasks.add_task(deck_store.refill, uid, filters)
+
+    total = deck.total
+    index = min(deck.seen + deck.served, total) if total > 0 else 0
+    has_more = deck.remaining() > 0 or not deck.exhausted
+
+    return {
+        "users": users,
+        "total": total,
+        "index": index,
+        "next_cursor": deck.cursor_token() if has_more else None,
+    }
+
     if target_id == current_user.user_id:
         raise HTTPException(status_code=400, detail="Không thể thích chính mình")
 
@@ -135,6 +176,7 @@ def skip_user(target_id: int, db: Session = Depends(get_db), current_user: User
         VALUES (:uid, :tid)
     """), {"uid": current_user.user_id, "tid": target_id})
     db.commit()
+    exclusion_index.on_skip(current_user.user_id, target_id)
 
     return {"message": "Đã bỏ qua người này!"}
 
@@ -181,6 +223,10 @@ def undo_skip_user(
     """), {"uid": current_user.user_id, "tid": target_id})
 
     db.commit()
+    exclusion_index.on_undo_skip(current_user.user_id, target_id)
+
+    # ✅ Build lại deck để người này có thể xuất hiện lại
+    deck_store.invalidate(current_user.user_id)
 
     return {"message": "Đã gỡ khỏi danh sách skip!"}
 
@@ -192,56 +238,39 @@ def like_user(target_id: int, db: Session = Depends(get_db), current_user: User
     if target_id == current_user.user_id:
         raise HTTPException(status_code=400, detail="Không thể thích chính mình")
 
-    # Kiểm tra đã like chưa
-    check = db.execute(text("""
-        SELECT * FROM likes 
-        WHERE from_user_id = :uid AND to_user_id = :tid
-    """), {"uid": current_user.user_id, "tid": target_id}).fetchone()
-
-    if check:
+    # ✅ Like + kiểm tra thích lại + tạo match trong 1 transaction
+    result = record_like(db, current_user.user_id, current_user.full_name, target_id)
+    if not result.target_found:
+        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
+    if not result.created:
         raise HTTPException(status_code=400, detail="Bạn đã thích người này rồi")
 
-    # ✅ Thêm vào bảng likes
-    db.execute(text("""
-        INSERT INTO likes (from_user_id, to_user_id)
-        VALUES (:uid, :tid)
-    """), {"uid": current_user.user_id, "tid": target_id})
-
-    # ✅ Thêm thông báo cho người bị thích
-    db.execute(text("""
-        INSERT INTO notifications (user_id, from_user_id, type, content, is_read)
-        VALUES (:to_user, :from_user, 'like', :content, 0)
-    """), {
-        "to_user": target_id,
-        "from_user": current_user.user_id,
-        "content": f"{current_user.full_name} đã thích bạn 💖"
-    })
-
-    # ✅ Kiểm tra xem người kia có thích lại chưa (match)
-    match_check = db.execute(text("""
-        SELECT * FROM likes
-        WHERE from_user_id = :tid AND to_user_id = :uid
-    """), {"uid": current_user.user_id, "tid": target_id}).fetchone()
-
-    if match_check:
-        # Nếu cả hai cùng thích nhau → tạo match
-        db.execute(text("""
-            INSERT INTO matches (user1_id, user2_id, status)
-            VALUES (:u1, :u2, 'active')
-        """), {"u1": current_user.user_id, "u2": target_id})
-
-        # Gửi thông báo match cho cả hai
-        db.execute(text("""
-            INSERT INTO notifications (user_id, from_user_id, type, content)
-            VALUES (:u1, :u2, 'match', :msg1),
-                   (:u2, :u1, 'match', :msg2)
-        """), {
-            "u1": current_user.user_id,
-            "u2": target_id,
-            "msg1": f"Bạn đã match với {target_id}! 💞",
-            "msg2": f"Bạn đã match với {current_user.full_name}! 💞"
-        })
-
-    db.commit()
+    if result.match_id:
+        return {"message": "Đã thích người này!", "matched": True, "match_id": result.match_id}
     return {"message": "Đã thích người này!"}
 
+
+# 📦 Ghi nhiều lượt quẹt 1 lần (client xếp hàng offline rồi đồng bộ)
+@router.post("/swipes")
+def bulk_swipes(
+    data: SwipeBatchRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    # ✅ Loại trùng: mỗi người chỉ giữ quyết định cuối cùng, bỏ qua chính mình
+    decisions = {}
+    for s in data.swipes:
+        if s.target_id != current_user.user_id:
+            decisions[s.target_id] = s.action
+
+    like_ids = [tid for tid, action in decisions.items() if action == "like"]
+    skip_ids = [tid for tid, action in decisions.items() if action == "skip"]
+
+    result = record_swipes(db, current_user.user_id, current_user.full_name, like_ids, skip_ids)
+    return {
+        "message": "Đã đồng bộ lượt quẹt!",
+        "liked": result.liked,
+        "skipped": result.skipped,
+        "matches": result.matches,
+        "not_found": result.not_found,
+    }
@@ -1,15 +1,20 @@
 import shutil
 import os
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from typing import Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from database import get_db
 from models.user_model import User
 from auth.dependencies import get_current_user
+from services.unread_counters import mark_conversation_read, unread_counters
 
 router = APIRouter(prefix="/messages", tags=["Messages"])
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 # ==================================================================
 # 🚨 QUAN TRỌNG: API UPLOAD PHẢI NẰM TRÊN CÙNG
 # (Trước các API có tham số động /{match_id})
@@ -53,10 +58,28 @@ async def upload_file(
 # 👇 CÁC API CÓ THAM SỐ ĐỘNG /{match_id} PHẢI NẰM DƯỚI 👇
 # ==================================================================
 
+# 👥 Tên + avatar của 2 người trong match (trả 1 lần thay vì JOIN cho từng tin nhắn)
+def get_participants(db: Session, match) -> dict:
+    rows = db.execute(text("""
+        SELECT u.user_id, u.full_name, p.url AS avatar
+        FROM users u
+        LEFT JOIN photos p ON u.user_id = p.user_id AND p.is_avatar = 1
+        WHERE u.user_id IN (:u1, :u2)
+    """), {"u1": match.user1_id, "u2": match.user2_id}).fetchall()
+    participants = {}
+    for r in rows:
+        participants.setdefault(r.user_id, {"full_name": r.full_name, "avatar": r.avatar})
+    return participants
+
+
 # 📨 Lấy danh sách tin nhắn
+# - Không truyền limit: trả toàn bộ như cũ
+# - ?limit=50[&before=<message_id>]: trang mới nhất (hoặc cũ hơn before), dùng index (match_id, message_id)
 @router.get("/{match_id}")
 def get_messages(
     match_id: int,
+    before: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
@@ -69,26 +92,54 @@ def get_messages(
     if not match:
         raise HTTPException(status_code=403, detail="Bạn không có quyền xem cuộc trò chuyện này")
 
-    # Truy vấn tin nhắn + thông tin người gửi
-    sql = text("""
-        SELECT 
-            m.message_id,
-            m.sender_id,
-            u.full_name AS sender_name,
-            p.url AS sender_avatar,
-            m.content,
-            m.type,
-            m.created_at,
-            CASE WHEN m.sender_id = :uid THEN TRUE ELSE FALSE END AS is_me
+    participants = get_participants(db, match)
+    params = {"mid": match_id, "uid": current_user.user_id}
+
+    if limit is None and before is None:
+        rows = db.execute(text("""
+            SELECT m.message_id, m.sender_id, m.content, m.type, m.created_at,
+                   CASE WHEN m.sender_id = :uid THEN TRUE ELSE FALSE END AS is_me
+            FROM messages m
+            WHERE m.match_id = :mid
+            ORDER BY m.message_id ASC
+        """), params).fetchall()
+
+        # Giữ nguyên định dạng cũ (sender_name / sender_avatar trên từng tin)
+        result = []
+        for r in rows:
+            sender = participants.get(r.sender_id, {})
+            item = dict(r._mapping)
+            item["sender_name"] = sender.get("full_name")
+            item["sender_avatar"] = sender.get("avatar")
+            result.append(item)
+        return result
+
+    # Lấy dư 1 dòng để biết còn trang cũ hơn không
+    params["limit"] = (limit or DEFAULT_PAGE_SIZE) + 1
+    before_sql = ""
+    if before is not None:
+        params["before"] = before
+        before_sql = "AND m.message_id < :before"
+
+    rows = db.execute(text(f"""
+        SELECT m.message_id, m.sender_id, m.content, m.type, m.created_at, m.is_read,
+               CASE WHEN m.sender_id = :uid THEN TRUE ELSE FALSE END AS is_me
         FROM messages m
-        JOIN users u ON u.user_id = m.sender_id
-        LEFT JOIN photos p ON u.user_id = p.user_id AND p.is_avatar = 1
-        WHERE m.match_id = :mid
-        ORDER BY m.created_at ASC
-    """)
+        WHERE m.match_id = :mid {before_sql}
+        ORDER BY m.message_id DESC
+        LIMIT :limit
+    """), params).fetchall()
 
-    rows = db.execute(sql, {"mid": match_id, "uid": current_user.user_id}).fetchall()
-    return [dict(r._mapping) for r in rows]
+    has_more = len(rows) == params["limit"]
+    rows = rows[:params["limit"] - 1]
+    rows.reverse()  # Cũ → mới giống giao diện chat
+
+    return {
+        "participants": participants,
+        "messages": [dict(r._mapping) for r in rows],
+        "has_more": has_more,
+        "next_before": rows[0].message_id if has_more else None,
+    }
 
 
 # 💬 Gửi tin nhắn (Text/Link ảnh)
@@ -115,4 +166,23 @@ def send_message(
 
     # Lưu ý: Việc lưu tin nhắn thực tế vào DB được xử lý qua WebSocket (message_ws.py)
     # API này chỉ để xác nhận hoặc dùng nếu bạn muốn lưu qua HTTP
-    return {"message": "Tin nhắn đã gửi"}
\ No newline at end of file
+    return {"message": "Tin nhắn đã gửi"}
+
+
+# 👁️ Đánh dấu đã đọc toàn bộ tin nhắn của đối phương trong match
+@router.put("/{match_id}/read")
+def mark_messages_read(
+    match_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    match = db.execute(
+        text("SELECT match_id FROM matches WHERE match_id = :mid AND (user1_id = :uid OR user2_id = :uid)"),
+        {"mid": match_id, "uid": current_user.user_id},
+    ).fetchone()
+
+    if not match:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền xem cuộc trò chuyện này")
+
+    cleared = mark_conversation_read(db, match_id, current_user.user_id)
+    return {"cleared": cleared, "counters": unread_counters.get(db, current_user.user_id)}
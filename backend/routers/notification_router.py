@@ -1,25 +1,59 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from database import get_db
 from models.user_model import User
 from auth.dependencies import get_current_user
+from services.unread_counters import unread_counters
 
 router = APIRouter(prefix="/notifications", tags=["Notifications"])
 
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+# 🔔 Danh sách thông báo
+# - Không truyền limit: toàn bộ như cũ
+# - ?limit=30[&before=<noti_id>]: theo trang, mới nhất trước (index (user_id, noti_id))
+# Cả 2 chế độ cùng sắp theo noti_id (thông báo gộp không đổi created_at / noti_id → không nhảy chỗ)
 @router.get("/")
-def get_notifications(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    sql = text("""
-        SELECT n.noti_id, n.type, n.content, n.is_read, n.created_at,
+def get_notifications(
+    before: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    params = {"uid": current_user.user_id}
+    paged = limit is not None or before is not None
+    cond = ""
+    page = ""
+    if before is not None:
+        params["before"] = before
+        cond = "AND n.noti_id < :before"
+    if paged:
+        params["limit"] = (limit or DEFAULT_PAGE_SIZE) + 1
+        page = "LIMIT :limit"
+
+    sql = text(f"""
+        SELECT n.noti_id, n.type, n.content, n.is_read, n.agg_count, n.created_at,
                u.full_name AS sender_name, p.url AS sender_avatar, u.user_id AS sender_id
         FROM notifications n
         LEFT JOIN users u ON n.from_user_id = u.user_id
         LEFT JOIN photos p ON u.user_id = p.user_id AND p.is_avatar = 1
-        WHERE n.user_id = :uid
-        ORDER BY n.created_at DESC
+        WHERE n.user_id = :uid {cond}
+        ORDER BY n.noti_id DESC
+        {page}
     """)
-    rows = db.execute(sql, {"uid": current_user.user_id}).fetchall()
-    return [dict(r._mapping) for r in rows]
+    rows = db.execute(sql, params).fetchall()
+    if not paged:
+        return [dict(r._mapping) for r in rows]
+
+    has_more = len(rows) == params["limit"]
+    rows = rows[:params["limit"] - 1]
+    return {
+        "items": [dict(r._mapping) for r in rows],
+        "next_before": rows[-1].noti_id if has_more else None,
+    }
 
 @router.put("/mark-read")
 def mark_notifications_read(
@@ -33,4 +67,5 @@ def mark_notifications_read(
     """)
     db.execute(sql, {"uid": current_user.user_id})
     db.commit()
+    unread_counters.on_notifications_read(current_user.user_id)
     return {"message": "All notifications marked as read"}
@@ -4,6 +4,9 @@ from sqlalchemy import text
 from database import get_db
 from models.user_model import User
 from auth.dependencies import get_current_user
+from services.candidate_index import candidate_index
+from services.principal_cache import principal_cache
+from utils.normalize import clean_spaces
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import date
@@ -105,11 +108,18 @@ def update_profile(
 
     # ✅ Cập nhật các field có giá trị
     update_dict = update_data.model_dump(exclude_unset=True) # Dùng model_dump cho Pydantic V2
+
+    # ✅ Chuẩn hóa thành phố ngay khi ghi ("  Hà   Nội " → "Hà Nội")
+    if update_dict.get("city"):
+        update_dict["city"] = clean_spaces(update_dict["city"])
+
     for field, value in update_dict.items():
         setattr(user, field, value)
 
     db.commit()
     db.refresh(user)
+    candidate_index.upsert_user(user)
+    principal_cache.invalidate(user.user_id)
 
     # ✅ Lấy lại ảnh + sở thích để trả về full profile
     photos = db.execute(
@@ -185,7 +195,7 @@ def update_interests(
             continue
 
         # ✅ Chuẩn hóa chữ
-        name = name.strip().capitalize()
+        name = clean_spaces(name).capitalize()
 
         # ✅ Kiểm tra sở thích đã tồn tại chưa
         existing = db.execute(text("SELECT interest_id FROM interests WHERE LOWER(name) = LOWER(:n)"), {"n": name}).fetchone()
@@ -217,7 +227,10 @@ def update_interests(
         {"uid": current_user.user_id}
     ).fetchall()
 
-    return {"message": "✅ Cập nhật sở thích thành công", "interests": [r[0] for r in result]}
+    names = [r[0] for r in result]
+    candidate_index.set_interests(current_user.user_id, names)
+
+    return {"message": "✅ Cập nhật sở thích thành công", "interests": names}
 
 
 # ===============================
@@ -0,0 +1,154 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from utils import fast_json
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+# memory://            → chỉ trong 1 process (mặc định, chạy 1 worker)
+# redis://host:6379/0  → nhiều worker / nhiều máy (cần cài thêm gói redis)
+BROKER_URL = os.getenv("BROKER_URL", "memory://")
+
+Handler = Callable[[str, dict], Awaitable[None]]
+
+
+class Broker(ABC):
+    """Pub/sub theo kênh: publish tới kênh → mọi handler đã subscribe (ở mọi worker) nhận được"""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict):
+        ...
+
+    @abstractmethod
+    async def subscribe(self, channel: str, handler: Handler):
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str, handler: Handler):
+        ...
+
+    def has_subscribers(self, channel: str) -> bool:
+        """False = chắc chắn không ai nghe kênh → bỏ qua publish (mặc định: không biết, coi như có)"""
+        return True
+
+    async def close(self):
+        pass
+
+
+class _LocalHandlers:
+    """Danh sách handler theo kênh trong 1 process (dùng chung cho cả 2 backend)"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Set[Handler]] = {}
+
+    def add(self, channel: str, handler: Handler) -> bool:
+        """True nếu đây là handler đầu tiên của kênh"""
+        first = channel not in self.handlers
+        self.handlers.setdefault(channel, set()).add(handler)
+        return first
+
+    def remove(self, channel: str, handler: Handler) -> bool:
+        """True nếu kênh không còn handler nào"""
+        handlers = self.handlers.get(channel)
+        if handlers is None:
+            return False
+        handlers.discard(handler)
+        if not handlers:
+            del self.handlers[channel]
+            return True
+        return False
+
+    async def dispatch(self, channel: str, message: dict):
+        for handler in list(self.handlers.get(channel, ())):
+            try:
+                await handler(channel, message)
+            except Exception as e:
+                print(f"⚠️ Broker handler error ({channel}): {e}")
+
+
+class InMemoryBroker(Broker):
+    def __init__(self):
+        self._local = _LocalHandlers()
+
+    async def publish(self, channel: str, message: dict):
+        await self._local.dispatch(channel, message)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self._local.add(channel, handler)
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        self._local.remove(channel, handler)
+
+    def has_subscribers(self, channel: str) -> bool:
+        return channel in self._local.handlers
+
+
+class RedisBroker(Broker):
+    """
+    Dùng Redis PUBLISH/SUBSCRIBE. Mỗi worker giữ 1 kết nối subscribe và chỉ đăng ký
+    các kênh có client đang kết nối ở worker đó.
+    client: truyền sẵn (vd: fakeredis khi test) hoặc tạo từ url.
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            import redis.asyncio as redis  # Chỉ cần khi dùng BROKER_URL=redis://
+            client = redis.from_url(url)
+        self._redis = client
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._local = _LocalHandlers()
+        self._reader: Optional[asyncio.Task] = None
+
+    @property
+    def client(self):
+        """Kết nối Redis dùng chung (vd: presence đồng bộ tập user online giữa các worker)"""
+        return self._redis
+
+    async def publish(self, channel: str, message: dict):
+        await self._redis.publish(channel, fast_json.dumps(message))
+
+    async def subscribe(self, channel: str, handler: Handler):
+        if self._local.add(channel, handler):
+            await self._pubsub.subscribe(channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read_loop())
+
+    async def unsubscribe(self, channel: str, handler: Handler):
+        if self._local.remove(channel, handler):
+            await self._pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        # Hết kênh đang nghe → dừng (subscribe lần sau sẽ tạo lại task đọc)
+        while self._local.handlers:
+            try:
+                msg = await self._pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Redis broker read error: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not msg or msg.get("type") != "message":
+                continue
+            channel = msg["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            await self._local.dispatch(channel, fast_json.loads(msg["data"]))
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        return RedisBroker(url)
+    return InMemoryBroker()
+
+
+broker = create_broker()
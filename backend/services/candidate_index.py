@@ -0,0 +1,300 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from utils.normalize import normalize_text
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+INDEX_REFRESH_SECONDS = 300    # Nạp lại toàn bộ định kỳ (bắt kịp thay đổi từ worker khác)
+
+
+class InterestVocabulary:
+    """Gán mỗi sở thích (đã chuẩn hóa) 1 vị trí bit cố định"""
+
+    def __init__(self):
+        self._bits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def mask(self, names: Iterable[str]) -> int:
+        mask = 0
+        for name in names:
+            b = self._bits.get(name)
+            if b is None:
+                with self._lock:
+                    b = self._bits.setdefault(name, len(self._bits))
+            mask |= 1 << b
+        return mask
+
+
+interest_vocab = InterestVocabulary()
+
+
+@dataclass
+class CandidateProfile:
+    """Thuộc tính dùng để lọc/xếp hạng của 1 user"""
+    user_id: int
+    gender: Optional[str]
+    birthday: Optional[date]
+    city: str = ""                                   # Đã chuẩn hóa (normalize_text)
+    interests: Set[str] = field(default_factory=set) # Đã chuẩn hóa
+    updated_at: Optional[datetime] = None
+
+    # Tính sẵn 1 lần để chấm điểm theo batch không phải xử lý lại từng request
+    interest_mask: int = field(init=False, default=0)
+    birth_ordinal: int = field(init=False, default=0)
+    active_ts: float = field(init=False, default=0.0)
+
+    def __post_init__(self):
+        self.interest_mask = interest_vocab.mask(self.interests)
+        self.birth_ordinal = self.birthday.toordinal() if self.birthday else 0
+        self.active_ts = self.updated_at.timestamp() if self.updated_at else 0.0
+
+
+def _gender_value(gender) -> Optional[str]:
+    # ⭐ FIX ENUM → STRING
+    if hasattr(gender, "value"):
+        return gender.value
+    return gender
+
+
+class CandidateIndex:
+    """Posting list theo giới tính × năm sinh × thành phố × sở thích (đã chuẩn hóa)"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._profiles: Dict[int, CandidateProfile] = {}
+        self._by_gender: Dict[str, Set[int]] = defaultdict(set)
+        self._by_birth_year: Dict[int, Set[int]] = defaultdict(set)
+        self._by_city: Dict[str, Set[int]] = defaultdict(set)
+        self._by_interest: Dict[str, Set[int]] = defaultdict(set)
+        self._loaded_at: Optional[float] = None
+        self._reloading = False
+        # List đã sắp xếp theo giới tính để chọn ngẫu nhiên O(1); cập nhật từng phần tử khi ghi
+        # (copy-on-write: list đã trả ra cho người đọc không bao giờ bị sửa)
+        self._gender_lists: Dict[str, List[int]] = {}
+
+    # ----------------------------- #
+    #  NẠP DỮ LIỆU
+    # ----------------------------- #
+    def _load(self, db: Session) -> Dict[int, CandidateProfile]:
+        profiles: Dict[int, CandidateProfile] = {}
+        rows = db.execute(text("""
+            SELECT user_id, gender, birthday, city, updated_at
+            FROM users
+            WHERE is_admin = 0
+        """)).fetchall()
+        for r in rows:
+            profiles[r.user_id] = CandidateProfile(
+                user_id=r.user_id,
+                gender=_gender_value(r.gender),
+                birthday=r.birthday,
+                city=normalize_text(r.city or ""),
+                updated_at=r.updated_at,
+            )
+
+        rows = db.execute(text("""
+            SELECT ui.user_id, i.name
+            FROM user_interests ui
+            JOIN interests i ON i.interest_id = ui.interest_id
+        """)).fetchall()
+        interests: Dict[int, Set[str]] = defaultdict(set)
+        for r in rows:
+            if r.user_id in profiles and r.name:
+                interests[r.user_id].add(normalize_text(r.name))
+        for uid, names in interests.items():
+            profiles[uid] = replace(profiles[uid], interests=names)
+        return profiles
+
+    def _swap(self, profiles: Dict[int, CandidateProfile]):
+        with self._lock:
+            self._profiles = {}
+            self._by_gender.clear()
+            self._by_birth_year.clear()
+            self._by_city.clear()
+            self._by_interest.clear()
+            for p in profiles.values():
+                self._add(p)
+            self._gender_lists = {g: sorted(ids) for g, ids in self._by_gender.items()}
+            self._loaded_at = time.monotonic()
+            self._reloading = False
+
+    def _reload_in_background(self):
+        db = SessionLocal()
+        try:
+            self._swap(self._load(db))
+        except Exception as e:
+            print(f"⚠️ Lỗi nạp lại candidate index: {e}")
+            with self._lock:
+                self._reloading = False
+        finally:
+            db.close()
+
+    def ensure_loaded(self, db: Session):
+        if self._loaded_at is None:
+            self._swap(self._load(db))
+            return
+        with self._lock:
+            stale = time.monotonic() - self._loaded_at > INDEX_REFRESH_SECONDS
+            if not stale or self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload_in_background, daemon=True).start()
+
+    # ----------------------------- #
+    #  POSTING LIST
+    # ----------------------------- #
+    def _add(self, p: CandidateProfile):
+        self._profiles[p.user_id] = p
+        if p.gender:
+            self._by_gender[p.gender].add(p.user_id)
+        if p.birthday:
+            self._by_birth_year[p.birthday.year].add(p.user_id)
+        if p.city:
+            self._by_city[p.city].add(p.user_id)
+        for name in p.interests:
+            self._by_interest[name].add(p.user_id)
+
+    def _remove(self, user_id: int) -> Optional[CandidateProfile]:
+        p = self._profiles.pop(user_id, None)
+        if p is None:
+            return None
+        for postings, key in (
+            [(self._by_gender, p.gender)]
+            + [(self._by_birth_year, p.birthday.year if p.birthday else None)]
+            + [(self._by_city, p.city)]
+            + [(self._by_interest, name) for name in p.interests]
+        ):
+            ids = postings.get(key)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del postings[key]
+        return p
+
+    def _move_gender(self, user_id: int, old: Optional[str], new: Optional[str]):
+        """Cập nhật list theo giới tính khi 1 user đổi giới tính / được thêm / bị xoá: O(n) copy, không sort lại"""
+        if old == new:
+            return
+        if old:
+            ids = self._gender_lists.get(old, [])
+            i = bisect_left(ids, user_id)
+            if i < len(ids) and ids[i] == user_id:
+                self._gender_lists[old] = ids[:i] + ids[i + 1:]
+        if new:
+            ids = self._gender_lists.get(new, [])
+            i = bisect_left(ids, user_id)
+            if i == len(ids) or ids[i] != user_id:
+                self._gender_lists[new] = ids[:i] + [user_id] + ids[i:]
+
+    # ----------------------------- #
+    #  CẬP NHẬT KHI GHI DB
+    # ----------------------------- #
+    def upsert_user(self, user):
+        """Gọi sau khi tạo/cập nhật hồ sơ (user là ORM User)"""
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            old = self._remove(user.user_id)
+            old_gender = old.gender if old else None
+            if getattr(user, "is_admin", 0):
+                self._move_gender(user.user_id, old_gender, None)
+                return
+            p = CandidateProfile(
+                user_id=user.user_id,
+                gender=_gender_value(user.gender),
+                birthday=user.birthday,
+                city=normalize_text(user.city or ""),
+                interests=old.interests if old else set(),
+                updated_at=getattr(user, "updated_at", None),
+            )
+            self._add(p)
+            self._move_gender(user.user_id, old_gender, p.gender)
+
+    def set_interests(self, user_id: int, names: Iterable[str]):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            p = self._remove(user_id)
+            if p is None:
+                return
+            self._add(replace(p, interests={normalize_text(n) for n in names if n}))
+
+    # ----------------------------- #
+    #  TRUY VẤN
+    # ----------------------------- #
+    def _match_keys(self, postings: Dict[str, Set[int]], needle: str) -> Set[int]:
+        """Tương đương LIKE '%x%' nhưng chỉ duyệt các key khác nhau (ít hơn nhiều so với số user)"""
+        result: Set[int] = set()
+        for key, ids in postings.items():
+            if needle in key:
+                result |= ids
+        return result
+
+    def query(self, db: Session, gender: Optional[str], min_birth: date, max_birth: date,
+              city: Optional[str] = None, interest: Optional[str] = None) -> List[int]:
+        """Trả về danh sách user_id (tăng dần) khớp bộ lọc"""
+        self.ensure_loaded(db)
+        with self._lock:
+            candidate_sets: List[Set[int]] = []
+
+            if gender:
+                candidate_sets.append(self._by_gender.get(gender, set()))
+
+            if city:
+                candidate_sets.append(self._match_keys(self._by_city, normalize_text(city)))
+
+            if interest:
+                candidate_sets.append(self._match_keys(self._by_interest, normalize_text(interest)))
+
+            by_age: Set[int] = set()
+            for year in range(min_birth.year, max_birth.year + 1):
+                by_age |= self._by_birth_year.get(year, set())
+            candidate_sets.append(by_age)
+
+            # Giao các tập từ nhỏ đến lớn
+            candidate_sets.sort(key=len)
+            result = set(candidate_sets[0])
+            for ids in candidate_sets[1:]:
+                if not result:
+                    break
+                result &= ids
+
+            # Năm đầu/cuối chỉ khớp một phần → kiểm tra chính xác ngày sinh
+            profiles = self._profiles
+            return sorted(
+                uid for uid in result
+                if min_birth <= profiles[uid].birthday <= max_birth
+            )
+
+    def gender_pool(self, db: Session, gender: str) -> List[int]:
+        """Danh sách user_id theo giới tính (dùng chung, KHÔNG sửa) để bốc ngẫu nhiên theo vị trí"""
+        self.ensure_loaded(db)
+        with self._lock:
+            return self._gender_lists.get(gender, [])
+
+    def profiles(self, user_ids: Iterable[int]) -> List[CandidateProfile]:
+        with self._lock:
+            return [self._profiles[uid] for uid in user_ids if uid in self._profiles]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._profiles),
+                "genders": len(self._by_gender),
+                "birth_years": len(self._by_birth_year),
+                "cities": len(self._by_city),
+                "interests": len(self._by_interest),
+            }
+
+
+candidate_index = CandidateIndex()
@@ -0,0 +1,90 @@
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from services.candidate_index import CandidateProfile
+
+# ===============================
+# ⚙️ TRỌNG SỐ ĐIỂM TƯƠNG HỢP
+# ===============================
+WEIGHT_INTERESTS = 0.40     # Tỉ lệ sở thích chung
+WEIGHT_AGE = 0.25           # Chênh lệch tuổi càng nhỏ càng cao
+WEIGHT_CITY = 0.20          # Cùng thành phố
+WEIGHT_ACTIVITY = 0.15      # Hoạt động gần đây (updated_at)
+JITTER = 0.05               # Nhiễu nhỏ để cùng điểm không luôn ra cùng thứ tự
+
+AGE_SCALE_DAYS = 5 * 365    # Lệch 5 tuổi → điểm tuổi còn ~37%
+ACTIVITY_SCALE_SECONDS = 7 * 24 * 3600
+
+_WORD_MASK = (1 << 64) - 1
+
+# Bảng popcount cho 1 byte
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _shared_interests(my_mask: int, candidates: Sequence[CandidateProfile]) -> np.ndarray:
+    """Đếm sở thích chung = popcount(mask ứng viên AND mask của mình), xử lý từng word 64 bit"""
+    n = len(candidates)
+    shared = np.zeros(n, dtype=np.int64)
+    word = 0
+    while my_mask >> (64 * word):
+        my_word = (my_mask >> (64 * word)) & _WORD_MASK
+        if my_word:
+            shift = 64 * word
+            cand_words = np.fromiter(
+                ((p.interest_mask >> shift) & _WORD_MASK for p in candidates),
+                dtype=np.uint64, count=n,
+            )
+            both = cand_words & np.uint64(my_word)
+            shared += _POPCOUNT[both.view(np.uint8)].reshape(n, 8).sum(axis=1, dtype=np.int64)
+        word += 1
+    return shared
+
+
+def score_candidates(me: Optional[CandidateProfile],
+                     candidates: Sequence[CandidateProfile],
+                     now: Optional[float] = None,
+                     rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Tính điểm tương hợp (0..1) cho cả batch ứng viên bằng NumPy"""
+    n = len(candidates)
+    if n == 0:
+        return np.zeros(0)
+    now = now if now is not None else time.time()
+    rng = rng or np.random.default_rng()
+
+    scores = np.zeros(n)
+
+    # ✅ 1. Sở thích chung (tỉ lệ trên số sở thích của mình)
+    if me is not None and me.interest_mask:
+        shared = _shared_interests(me.interest_mask, candidates)
+        scores += WEIGHT_INTERESTS * np.minimum(shared / len(me.interests), 1.0)
+
+    # ✅ 2. Chênh lệch tuổi
+    if me is not None and me.birth_ordinal:
+        births = np.fromiter((p.birth_ordinal for p in candidates), dtype=np.float64, count=n)
+        age_score = np.exp(-np.abs(births - me.birth_ordinal) / AGE_SCALE_DAYS)
+        age_score[births == 0] = 0.0
+        scores += WEIGHT_AGE * age_score
+
+    # ✅ 3. Cùng thành phố
+    if me is not None and me.city:
+        same_city = np.fromiter((p.city == me.city for p in candidates), dtype=bool, count=n)
+        scores += WEIGHT_CITY * same_city
+
+    # ✅ 4. Hoạt động gần đây
+    active = np.fromiter((p.active_ts for p in candidates), dtype=np.float64, count=n)
+    activity = np.exp(-np.maximum(now - active, 0.0) / ACTIVITY_SCALE_SECONDS)
+    activity[active == 0] = 0.0
+    scores += WEIGHT_ACTIVITY * activity
+
+    scores += rng.random(n) * JITTER
+    return scores
+
+
+def rank_candidates(me: Optional[CandidateProfile],
+                    candidates: Sequence[CandidateProfile]) -> List[int]:
+    """Trả về user_id sắp theo điểm giảm dần"""
+    scores = score_candidates(me, candidates)
+    order = np.argsort(-scores, kind="stable")
+    return [candidates[i].user_id for i in order]
@@ -0,0 +1,178 @@
+import threading
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import DateTime, text
+from sqlalchemy.orm import Session
+
+# Import model để create_all() tạo bảng conversation_summaries
+from models.conversation_summary_model import ConversationSummary  # noqa: F401
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+PREVIEW_LENGTH = 255                 # = độ dài cột last_message
+CURSOR_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+# Tin nhắn loại này cập nhật bản xem trước nhưng không tính là chưa đọc
+NOT_UNREAD_TYPES = ("call_log",)
+
+# User đã được tạo đủ dòng tóm tắt trong worker này (chỉ backfill 1 lần)
+_backfilled: Set[int] = set()
+_backfilled_lock = threading.Lock()
+
+# Dựng dòng tóm tắt từ bảng messages cho các match thỏa {where} (chỉ dòng còn thiếu)
+_BACKFILL_SQL = """
+    INSERT IGNORE INTO conversation_summaries
+        (match_id, user_id, partner_id, last_message, last_message_type, last_sender_id,
+         last_message_time, unread_count, last_activity_at)
+    SELECT s.match_id, s.user_id, s.partner_id,
+           SUBSTR(lm.content, 1, {preview}), lm.type, lm.sender_id, lm.created_at,
+           (
+               SELECT COUNT(*) FROM messages x
+               WHERE x.match_id = s.match_id AND x.sender_id != s.user_id
+                 AND x.is_read = 0 AND x.type NOT IN ('call_log')
+           ),
+           COALESCE(lm.created_at, s.created_at, NOW())
+    FROM (
+        SELECT match_id, user1_id AS user_id, user2_id AS partner_id, created_at
+        FROM matches WHERE {where}
+        UNION ALL
+        SELECT match_id, user2_id AS user_id, user1_id AS partner_id, created_at
+        FROM matches WHERE {where}
+    ) s
+    LEFT JOIN messages lm
+        ON lm.message_id = (SELECT MAX(message_id) FROM messages WHERE match_id = s.match_id)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM conversation_summaries cs
+        WHERE cs.match_id = s.match_id AND cs.user_id = s.user_id
+    )
+"""
+
+
+def _backfill(db: Session, where: str, params: dict):
+    db.execute(text(_BACKFILL_SQL.format(where=where, preview=PREVIEW_LENGTH)), params)
+
+
+# ----------------------------- #
+#  GHI (gọi trong transaction của bên gọi, bên gọi tự commit)
+# ----------------------------- #
+def on_match_created(db: Session, match_id: int, user1_id: int, user2_id: int):
+    """Tạo sẵn 2 dòng tóm tắt cho match mới"""
+    db.execute(text("""
+        INSERT IGNORE INTO conversation_summaries
+            (match_id, user_id, partner_id, unread_count, last_activity_at)
+        VALUES (:mid, :u1, :u2, 0, NOW()), (:mid, :u2, :u1, 0, NOW())
+    """), {"mid": match_id, "u1": user1_id, "u2": user2_id})
+
+
+def on_message(db: Session, match_id: int, sender_id: int, content: str, msg_type: str,
+               receiver_active: bool = False):
+    """Cập nhật tin nhắn cuối + tăng số chưa đọc của người nhận
+    (receiver_active: người nhận đang mở khung chat → tin đã xem, không tăng)"""
+    updated = db.execute(text("""
+        UPDATE conversation_summaries
+        SET last_message = :preview,
+            last_message_type = :type,
+            last_sender_id = :sid,
+            last_message_time = NOW(),
+            last_activity_at = NOW(),
+            unread_count = unread_count + CASE WHEN user_id != :sid AND :counts = 1 THEN 1 ELSE 0 END
+        WHERE match_id = :mid
+    """), {
+        "mid": match_id,
+        "sid": sender_id,
+        "preview": (content or "")[:PREVIEW_LENGTH],
+        "type": msg_type,
+        "counts": 0 if receiver_active or msg_type in NOT_UNREAD_TYPES else 1,
+    })
+    if updated.rowcount < 2:
+        # Match cũ chưa có dòng tóm tắt → dựng từ messages (đã gồm tin vừa ghi)
+        _backfill(db, "match_id = :mid", {"mid": match_id})
+
+
+def refresh_match(db: Session, match_id: int):
+    """Dựng lại tóm tắt của 1 match (vd: sau khi admin xoá tin nhắn)"""
+    db.execute(text("DELETE FROM conversation_summaries WHERE match_id = :mid"), {"mid": match_id})
+    _backfill(db, "match_id = :mid", {"mid": match_id})
+
+
+def delete_match(db: Session, match_id: int):
+    db.execute(text("DELETE FROM conversation_summaries WHERE match_id = :mid"), {"mid": match_id})
+
+
+def ensure_backfilled(db: Session, user_id: int):
+    """Lần đầu user mở inbox trong worker này: tạo dòng tóm tắt cho các match cũ"""
+    with _backfilled_lock:
+        if user_id in _backfilled:
+            return
+    _backfill(db, "(user1_id = :uid OR user2_id = :uid)", {"uid": user_id})
+    db.commit()
+    with _backfilled_lock:
+        _backfilled.add(user_id)
+
+
+# ----------------------------- #
+#  ĐỌC INBOX (keyset)
+# ----------------------------- #
+def encode_cursor(last_activity_at: datetime, match_id: int) -> str:
+    return f"{last_activity_at.strftime(CURSOR_TIME_FORMAT)}.{match_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """ValueError nếu cursor sai định dạng"""
+    ts, match_id = cursor.split(".")
+    return datetime.strptime(ts, CURSOR_TIME_FORMAT), int(match_id)
+
+
+def list_inbox(db: Session, user_id: int, limit: Optional[int] = None,
+               cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Danh sách match (mới hoạt động trước) + cursor trang sau (None nếu hết)"""
+    ensure_backfilled(db, user_id)
+
+    params = {"uid": user_id}
+    after = ""
+    if cursor:
+        params["ts"], params["cursor_mid"] = decode_cursor(cursor)
+        after = """
+          AND (cs.last_activity_at < :ts
+               OR (cs.last_activity_at = :ts AND cs.match_id < :cursor_mid))
+        """
+    page = ""
+    if limit:
+        params["limit"] = limit + 1
+        page = "LIMIT :limit"
+
+    rows = db.execute(text(f"""
+        SELECT
+            cs.match_id,
+            cs.partner_id,
+            u.full_name,
+            p.url AS avatar_url,
+            m.created_at,
+            cs.last_message,
+            cs.last_message_time,
+            cs.last_sender_id,
+            cs.unread_count,
+            cs.last_activity_at
+        FROM conversation_summaries cs
+        JOIN matches m ON m.match_id = cs.match_id AND m.status = 'active'
+        JOIN users u ON u.user_id = cs.partner_id
+        LEFT JOIN photos p ON p.user_id = u.user_id AND p.is_avatar = 1
+        WHERE cs.user_id = :uid
+        {after}
+        ORDER BY cs.last_activity_at DESC, cs.match_id DESC
+        {page}
+    """).columns(last_activity_at=DateTime), params).fetchall()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].last_activity_at, rows[-1].match_id)
+
+    items = []
+    for r in rows:
+        item = dict(r._mapping)
+        item.pop("last_activity_at")
+        items.append(item)
+    return items, next_cursor
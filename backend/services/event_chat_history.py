@@ -0,0 +1,79 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, text
+from sqlalchemy.orm import Session
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_REPLAY = 500               # Số tin tối đa gửi lại khi WebSocket kết nối lại với ?since=
+
+_SELECT = """
+    SELECT m.id, m.content, m.type, m.created_at, m.sender_id, u.full_name AS sender_name
+    FROM event_messages m
+    JOIN users u ON m.sender_id = u.user_id
+    WHERE m.event_id = :eid
+"""
+
+
+def _query(db: Session, sql: str, params: dict) -> list:
+    return db.execute(text(_SELECT + sql).columns(created_at=DateTime), params).fetchall()
+
+
+def format_message(m, user_id: int) -> dict:
+    """Cùng định dạng với frame WebSocket"""
+    return {
+        "id": m.id,
+        "type": m.type or "text",
+        "content": m.content,
+        "sender_id": m.sender_id,
+        "sender_name": m.sender_name,
+        # Format thời gian thành HH:MM
+        "created_at": m.created_at.strftime("%H:%M") if m.created_at else "",
+        "is_me": m.sender_id == user_id,
+    }
+
+
+def fetch_all(db: Session, event_id: int) -> list:
+    return _query(db, " ORDER BY m.id ASC", {"eid": event_id})
+
+
+def fetch_before(db: Session, event_id: int, before: Optional[int],
+                 limit: int) -> Tuple[list, bool]:
+    """Trang mới nhất (hoặc cũ hơn before), trả về theo thứ tự cũ → mới + còn trang cũ hơn không"""
+    params = {"eid": event_id, "limit": limit + 1}
+    cond = ""
+    if before is not None:
+        params["before"] = before
+        cond = " AND m.id < :before"
+    rows = _query(db, cond + " ORDER BY m.id DESC LIMIT :limit", params)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, has_more
+
+
+def fetch_since(db: Session, event_id: int, since: int, limit: int) -> Tuple[list, bool]:
+    """Các tin có id > since (tin bị lỡ khi mất kết nối) + còn tin mới hơn không"""
+    rows = _query(db, " AND m.id > :since ORDER BY m.id ASC LIMIT :limit",
+                  {"eid": event_id, "since": since, "limit": limit + 1})
+    has_more = len(rows) > limit
+    return rows[:limit], has_more
+
+
+def page_response(rows: List, has_more: bool, user_id: int, since: bool = False) -> dict:
+    """since=True (trang của fetch_since) → trả next_since = id mới nhất; ngược lại next_before = id cũ nhất"""
+    messages = [format_message(m, user_id) for m in rows]
+    if since:
+        return {
+            "messages": messages,
+            "has_more": has_more,
+            "next_since": messages[-1]["id"] if has_more and messages else None,
+        }
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "next_before": messages[0]["id"] if has_more and messages else None,
+    }
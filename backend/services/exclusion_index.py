@@ -0,0 +1,232 @@
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Union
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+EXCLUSION_TTL_SECONDS = 600    # Hết hạn → đọc lại từ DB (đồng bộ giữa các worker)
+MAX_CACHED_USERS = 50_000      # Giới hạn số user giữ trong RAM (LRU)
+
+_ARRAY_MAX = 4096              # Container dạng mảng tối đa 4096 phần tử (= 8KB)
+_BITMAP_BYTES = 8192           # Container dạng bitmap: 65536 bit
+
+
+class RoaringSet:
+    """Tập số nguyên kiểu roaring: chia theo 16 bit cao, mỗi khối là mảng sắp xếp hoặc bitmap"""
+    __slots__ = ("_containers", "_size")
+
+    def __init__(self, values=()):
+        self._containers: Dict[int, Union[array, bytearray]] = {}
+        self._size = 0
+        for v in values:
+            self.add(v)
+
+    def add(self, value: int) -> bool:
+        hi, lo = value >> 16, value & 0xFFFF
+        c = self._containers.get(hi)
+        if c is None:
+            c = self._containers[hi] = array("H")
+
+        if isinstance(c, array):
+            i = bisect_left(c, lo)
+            if i < len(c) and c[i] == lo:
+                return False
+            if len(c) < _ARRAY_MAX:
+                c.insert(i, lo)
+            else:
+                # Mảng đầy → chuyển sang bitmap
+                bitmap = bytearray(_BITMAP_BYTES)
+                for x in c:
+                    bitmap[x >> 3] |= 1 << (x & 7)
+                bitmap[lo >> 3] |= 1 << (lo & 7)
+                self._containers[hi] = bitmap
+        else:
+            bit = 1 << (lo & 7)
+            if c[lo >> 3] & bit:
+                return False
+            c[lo >> 3] |= bit
+
+        self._size += 1
+        return True
+
+    def discard(self, value: int) -> bool:
+        hi, lo = value >> 16, value & 0xFFFF
+        c = self._containers.get(hi)
+        if c is None:
+            return False
+
+        if isinstance(c, array):
+            i = bisect_left(c, lo)
+            if i >= len(c) or c[i] != lo:
+                return False
+            del c[i]
+            if not c:
+                del self._containers[hi]
+        else:
+            bit = 1 << (lo & 7)
+            if not c[lo >> 3] & bit:
+                return False
+            c[lo >> 3] &= ~bit
+
+        self._size -= 1
+        return True
+
+    def __contains__(self, value: int) -> bool:
+        c = self._containers.get(value >> 16)
+        if c is None:
+            return False
+        lo = value & 0xFFFF
+        if isinstance(c, array):
+            i = bisect_left(c, lo)
+            return i < len(c) and c[i] == lo
+        return bool(c[lo >> 3] & (1 << (lo & 7)))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        for hi in sorted(self._containers):
+            c = self._containers[hi]
+            base = hi << 16
+            if isinstance(c, array):
+                for lo in c:
+                    yield base | lo
+            else:
+                for byte_idx, byte in enumerate(c):
+                    while byte:
+                        low_bit = byte & -byte
+                        yield base | (byte_idx << 3) | (low_bit.bit_length() - 1)
+                        byte ^= low_bit
+
+    def nbytes(self) -> int:
+        """Ước lượng bộ nhớ đang dùng (byte)"""
+        total = sys.getsizeof(self._containers)
+        for c in self._containers.values():
+            total += sys.getsizeof(c)
+        return total
+
+
+class UserExclusions:
+    """Những người user đã like / skip / match (tách riêng để gỡ skip không ảnh hưởng like)"""
+    __slots__ = ("liked", "skipped", "matched", "loaded_at")
+
+    def __init__(self):
+        self.liked = RoaringSet()
+        self.skipped = RoaringSet()
+        self.matched = RoaringSet()
+        self.loaded_at = time.monotonic()
+
+    def excludes(self, candidate_id: int) -> bool:
+        return (candidate_id in self.liked
+                or candidate_id in self.skipped
+                or candidate_id in self.matched)
+
+    def nbytes(self) -> int:
+        return (sys.getsizeof(self) + self.liked.nbytes()
+                + self.skipped.nbytes() + self.matched.nbytes())
+
+
+def _load_from_db(db: Session, user_id: int) -> UserExclusions:
+    ex = UserExclusions()
+    params = {"uid": user_id}
+
+    for r in db.execute(text("SELECT to_user_id FROM likes WHERE from_user_id = :uid"), params):
+        ex.liked.add(r[0])
+    for r in db.execute(text("SELECT target_user_id FROM skips WHERE user_id = :uid"), params):
+        ex.skipped.add(r[0])
+    for r in db.execute(text("""
+        SELECT user1_id FROM matches WHERE user2_id = :uid
+        UNION
+        SELECT user2_id FROM matches WHERE user1_id = :uid
+    """), params):
+        ex.matched.add(r[0])
+    return ex
+
+
+class ExclusionIndex:
+    """Chỉ mục 'đã xem' theo user, nạp lười từ DB và cập nhật khi like/skip/match/gỡ skip"""
+
+    def __init__(self):
+        self._users: "OrderedDict[int, UserExclusions]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id: int) -> Optional[UserExclusions]:
+        ex = self._users.get(user_id)
+        if ex is None:
+            return None
+        if time.monotonic() - ex.loaded_at > EXCLUSION_TTL_SECONDS:
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return ex
+
+    def get(self, db: Session, user_id: int) -> UserExclusions:
+        with self._lock:
+            ex = self._cached(user_id)
+        if ex is not None:
+            return ex
+
+        ex = _load_from_db(db, user_id)
+        with self._lock:
+            self._users[user_id] = ex
+            while len(self._users) > MAX_CACHED_USERS:
+                self._users.popitem(last=False)
+        return ex
+
+    # ----------------------------- #
+    #  CẬP NHẬT KHI GHI DB
+    #  (user chưa được nạp thì bỏ qua, lần sau sẽ đọc từ DB)
+    # ----------------------------- #
+    def on_like(self, user_id: int, target_id: int):
+        with self._lock:
+            ex = self._users.get(user_id)
+            if ex is not None:
+                ex.liked.add(target_id)
+
+    def on_skip(self, user_id: int, target_id: int):
+        with self._lock:
+            ex = self._users.get(user_id)
+            if ex is not None:
+                ex.skipped.add(target_id)
+
+    def on_undo_skip(self, user_id: int, target_id: int):
+        with self._lock:
+            ex = self._users.get(user_id)
+            if ex is not None:
+                ex.skipped.discard(target_id)
+
+    def on_match(self, user1_id: int, user2_id: int):
+        with self._lock:
+            for uid, other in ((user1_id, user2_id), (user2_id, user1_id)):
+                ex = self._users.get(uid)
+                if ex is not None:
+                    ex.matched.add(other)
+
+    def stats(self) -> dict:
+        """Thống kê kích thước để ước lượng chi phí RAM"""
+        with self._lock:
+            entries = list(self._users.values())
+
+        users = len(entries)
+        ids = sum(len(e.liked) + len(e.skipped) + len(e.matched) for e in entries)
+        nbytes = sum(e.nbytes() for e in entries)
+        per_user = nbytes / users if users else 0
+        return {
+            "users": users,
+            "excluded_ids": ids,
+            "avg_ids_per_user": round(ids / users, 2) if users else 0,
+            "memory_bytes": nbytes,
+            "avg_bytes_per_user": round(per_user, 1),
+            "estimated_bytes_per_100k_users": int(per_user * 100_000),
+        }
+
+
+exclusion_index = ExclusionIndex()
@@ -0,0 +1,230 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from services import conversation_summary
+from services.exclusion_index import exclusion_index
+from services.unread_counters import unread_counters
+
+MYSQL_DEADLOCK = 1213
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class LikeResult:
+    created: bool                   # False → đã like người này từ trước (hoặc người này không tồn tại)
+    match_id: Optional[int] = None  # Có giá trị khi lượt like này tạo ra match
+    target_found: bool = True       # False → target_id không có trong users
+
+
+@dataclass
+class SwipeBatchResult:
+    liked: int = 0                                   # Số lượt like mới (bỏ qua like trùng)
+    skipped: int = 0                                 # Số lượt skip mới
+    matches: List[dict] = field(default_factory=list)  # [{"match_id", "user_id"}] mới tạo
+    liked_ids: List[int] = field(default_factory=list)    # Like thật sự được ghi
+    skipped_ids: List[int] = field(default_factory=list)  # Skip hợp lệ (người tồn tại)
+    not_found: List[int] = field(default_factory=list)    # ID không có trong users → bỏ qua
+
+
+def _is_deadlock(e: OperationalError) -> bool:
+    return getattr(e.orig, "errno", None) == MYSQL_DEADLOCK
+
+
+def _existing_users(db: Session, user_ids: List[int]) -> Set[int]:
+    """ID có trong users (INSERT IGNORE biến lỗi khoá ngoại thành cảnh báo → phải lọc trước)"""
+    if not user_ids:
+        return set()
+    rows = db.execute(text("SELECT user_id FROM users WHERE user_id IN :ids")
+                      .bindparams(bindparam("ids", expanding=True)), {"ids": user_ids}).fetchall()
+    return {r.user_id for r in rows}
+
+
+def _like_once(db: Session, user_id: int, full_name: str, target_id: int) -> LikeResult:
+    params = {"uid": user_id, "tid": target_id}
+
+    if not _existing_users(db, [target_id]):
+        db.rollback()
+        return LikeResult(created=False, target_found=False)
+
+    # ✅ 1. Thêm like (unique (from, to) → trùng thì bỏ qua, không cần SELECT trước)
+    inserted = db.execute(text("""
+        INSERT IGNORE INTO likes (from_user_id, to_user_id)
+        VALUES (:uid, :tid)
+    """), params)
+    if inserted.rowcount == 0:
+        db.rollback()
+        return LikeResult(created=False)
+
+    # ✅ 2. Kiểm tra thích lại + tạo match trong cùng 1 câu lệnh
+    # (unique cặp LEAST/GREATEST → 2 lượt like đồng thời cũng chỉ ra 1 match)
+    matched = db.execute(text("""
+        INSERT IGNORE INTO matches (user1_id, user2_id, status)
+        SELECT :uid, :tid, 'active'
+        FROM likes
+        WHERE from_user_id = :tid AND to_user_id = :uid
+    """), params)
+    match_id = matched.lastrowid if matched.rowcount == 1 else None
+    if match_id:
+        conversation_summary.on_match_created(db, match_id, user_id, target_id)
+
+    # ✅ 3. Thông báo like (+ match cho cả hai) trong 1 lần INSERT
+    if match_id:
+        db.execute(text("""
+            INSERT INTO notifications (user_id, from_user_id, type, content, is_read)
+            VALUES (:tid, :uid, 'like', :like_msg, 0),
+                   (:uid, :tid, 'match', :msg1, 0),
+                   (:tid, :uid, 'match', :msg2, 0)
+        """), {
+            **params,
+            "like_msg": f"{full_name} đã thích bạn 💖",
+            "msg1": f"Bạn đã match với {target_id}! 💞",
+            "msg2": f"Bạn đã match với {full_name}! 💞",
+        })
+    else:
+        db.execute(text("""
+            INSERT INTO notifications (user_id, from_user_id, type, content, is_read)
+            VALUES (:tid, :uid, 'like', :like_msg, 0)
+        """), {**params, "like_msg": f"{full_name} đã thích bạn 💖"})
+
+    db.commit()
+    unread_counters.on_notifications([target_id, user_id, target_id] if match_id else [target_id])
+    return LikeResult(created=True, match_id=match_id)
+
+
+def _match_ids_with(db: Session, user_id: int, target_ids: List[int]) -> Dict[int, int]:
+    """partner_id → match_id của các match giữa user và danh sách target"""
+    rows = db.execute(text("""
+        SELECT match_id, user2_id AS partner_id FROM matches
+        WHERE user1_id = :uid AND user2_id IN :tids
+        UNION ALL
+        SELECT match_id, user1_id AS partner_id FROM matches
+        WHERE user2_id = :uid AND user1_id IN :tids
+    """).bindparams(bindparam("tids", expanding=True)), {"uid": user_id, "tids": target_ids}).fetchall()
+    return {r.partner_id: r.match_id for r in rows}
+
+
+def _swipes_once(db: Session, user_id: int, full_name: str,
+                 like_ids: List[int], skip_ids: List[int]) -> SwipeBatchResult:
+    result = SwipeBatchResult()
+    notifications: List[dict] = []
+
+    # ✅ 0. Bỏ ID không tồn tại (không được tính là like / skip thành công)
+    valid = _existing_users(db, like_ids + skip_ids)
+    result.not_found = [tid for tid in like_ids + skip_ids if tid not in valid]
+    like_ids = [tid for tid in like_ids if tid in valid]
+    skip_ids = [tid for tid in skip_ids if tid in valid]
+    result.skipped_ids = skip_ids
+
+    if like_ids:
+        # ✅ 1. Lọc người đã like từ trước (để không gửi lại thông báo)
+        # FOR UPDATE: khoá các cặp (from, to) → request song song không chen INSERT vào giữa,
+        # nên mọi dòng trong new_likes chắc chắn được INSERT ở bước 2
+        existing = db.execute(text("""
+            SELECT to_user_id FROM likes
+            WHERE from_user_id = :uid AND to_user_id IN :tids
+            FOR UPDATE
+        """).bindparams(bindparam("tids", expanding=True)), {"uid": user_id, "tids": like_ids}).fetchall()
+        already = {r.to_user_id for r in existing}
+        new_likes = [tid for tid in like_ids if tid not in already]
+        result.liked_ids = new_likes
+
+        if new_likes:
+            # ✅ 2. Ghi toàn bộ like trong 1 câu INSERT nhiều dòng
+            inserted = db.execute(
+                text("INSERT IGNORE INTO likes (from_user_id, to_user_id) VALUES " + ", ".join(
+                    f"(:uid, :t{i})" for i in range(len(new_likes))
+                )),
+                {"uid": user_id, **{f"t{i}": tid for i, tid in enumerate(new_likes)}},
+            )
+            result.liked = inserted.rowcount
+
+            # ✅ 3. Tạo match cho những người đã thích lại (1 câu INSERT ... SELECT)
+            before = _match_ids_with(db, user_id, new_likes)
+            db.execute(text("""
+                INSERT IGNORE INTO matches (user1_id, user2_id, status)
+                SELECT :uid, from_user_id, 'active'
+                FROM likes
+                WHERE to_user_id = :uid AND from_user_id IN :tids
+            """).bindparams(bindparam("tids", expanding=True)), {"uid": user_id, "tids": new_likes})
+            after = _match_ids_with(db, user_id, new_likes)
+
+            for tid in new_likes:
+                notifications.append({"to": tid, "from": user_id, "type": "like",
+                                      "content": f"{full_name} đã thích bạn 💖"})
+                if tid in after and tid not in before:
+                    result.matches.append({"match_id": after[tid], "user_id": tid})
+                    conversation_summary.on_match_created(db, after[tid], user_id, tid)
+                    notifications.append({"to": user_id, "from": tid, "type": "match",
+                                          "content": f"Bạn đã match với {tid}! 💞"})
+                    notifications.append({"to": tid, "from": user_id, "type": "match",
+                                          "content": f"Bạn đã match với {full_name}! 💞"})
+
+    if skip_ids:
+        # ✅ 4. Ghi toàn bộ skip trong 1 câu INSERT nhiều dòng
+        inserted = db.execute(
+            text("INSERT IGNORE INTO skips (user_id, target_user_id) VALUES " + ", ".join(
+                f"(:uid, :t{i})" for i in range(len(skip_ids))
+            )),
+            {"uid": user_id, **{f"t{i}": tid for i, tid in enumerate(skip_ids)}},
+        )
+        result.skipped = inserted.rowcount
+
+    if notifications:
+        # ✅ 5. Toàn bộ thông báo trong 1 câu INSERT
+        params = {}
+        values = []
+        for i, n in enumerate(notifications):
+            values.append(f"(:to{i}, :from{i}, :type{i}, :content{i}, 0)")
+            params.update({f"to{i}": n["to"], f"from{i}": n["from"],
+                           f"type{i}": n["type"], f"content{i}": n["content"]})
+        db.execute(text(
+            "INSERT INTO notifications (user_id, from_user_id, type, content, is_read) VALUES "
+            + ", ".join(values)
+        ), params)
+
+    db.commit()
+    unread_counters.on_notifications(n["to"] for n in notifications)
+    return result
+
+
+def record_swipes(db: Session, user_id: int, full_name: str,
+                  like_ids: List[int], skip_ids: List[int]) -> SwipeBatchResult:
+    """Ghi 1 lô like/skip (đã loại trùng) trong 1 transaction, trả về các match mới"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            result = _swipes_once(db, user_id, full_name, like_ids, skip_ids)
+            break
+        except OperationalError as e:
+            db.rollback()
+            if not _is_deadlock(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+
+    for tid in result.liked_ids:
+        exclusion_index.on_like(user_id, tid)
+    for tid in result.skipped_ids:
+        exclusion_index.on_skip(user_id, tid)
+    for m in result.matches:
+        exclusion_index.on_match(user_id, m["user_id"])
+    return result
+
+
+def record_like(db: Session, user_id: int, full_name: str, target_id: int) -> LikeResult:
+    """Like + phát hiện thích lại + tạo match trong 1 transaction (thử lại nếu deadlock)"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            result = _like_once(db, user_id, full_name, target_id)
+            break
+        except OperationalError as e:
+            db.rollback()
+            if not _is_deadlock(e) or attempt == MAX_ATTEMPTS - 1:
+                raise
+
+    if result.created:
+        exclusion_index.on_like(user_id, target_id)
+    if result.match_id:
+        exclusion_index.on_match(user_id, target_id)
+    return result
@@ -0,0 +1,39 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+PREVIEW_LENGTH = 30
+
+
+def message_preview_content(content: str) -> str:
+    preview = content[:PREVIEW_LENGTH] + "..." if len(content) > PREVIEW_LENGTH else content
+    return f"📩 Bạn có tin nhắn mới: {preview}"
+
+
+def aggregated_message_content(count: int) -> str:
+    return f"📩 Bạn có {count} tin nhắn mới"
+
+
+def coalesce_message_notification(db: Session, sender_id: int, receiver_id: int, content: str) -> bool:
+    """
+    Gộp vào thông báo 'message' CHƯA ĐỌC của cặp (người nhận, người gửi) nếu có, nếu không thì tạo mới.
+    Upsert thật (unique (user_id, pending_from), xem utils/db_schema): 2 tin đến cùng lúc không tạo 2 dòng,
+    không mất lượt cộng. Không commit (đi chung transaction với tin nhắn). Trả về True nếu vừa tạo dòng mới.
+    """
+    params = {"uid": receiver_id, "from_id": sender_id}
+    result = db.execute(text("""
+        INSERT INTO notifications (user_id, from_user_id, type, content, agg_count, created_at)
+        VALUES (:uid, :from_id, 'message', :content, 1, NOW())
+        ON DUPLICATE KEY UPDATE agg_count = agg_count + 1
+    """), {**params, "content": message_preview_content(content)})
+    if result.rowcount == 1:
+        return True
+
+    # Đã cộng vào dòng chưa đọc có sẵn (dòng đang bị transaction này khoá) → cập nhật nội dung theo số mới
+    # created_at giữ nguyên: feed sắp theo noti_id, dòng không đổi chỗ
+    pending = db.execute(text("""
+        SELECT noti_id, agg_count FROM notifications
+        WHERE user_id = :uid AND pending_from = :from_id
+    """), params).fetchone()
+    db.execute(text("UPDATE notifications SET content = :content WHERE noti_id = :nid"),
+               {"content": aggregated_message_content(pending.agg_count), "nid": pending.noti_id})
+    return False
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from services.notification_coalescer import aggregated_message_content
+from services.unread_counters import unread_counters
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+COMPACTION_INTERVAL_SECONDS = 3600   # Chạy mỗi giờ
+READ_RETENTION_DAYS = 30             # Thông báo ĐÃ ĐỌC cũ hơn → xoá
+BATCH_SIZE = 1000                    # Xử lý theo lô để không khoá bảng lâu
+# Khoá tên của MySQL (GET_LOCK): chạy nhiều worker thì chỉ 1 worker dọn mỗi lượt
+COMPACTION_LOCK_NAME = "loveconnect_notification_compaction"
+
+
+def collapse_message_notifications(db: Session) -> int:
+    """Gộp các thông báo 'message' CHƯA ĐỌC cùng (người nhận, người gửi) thành 1 dòng (giữ dòng mới nhất).
+    Dòng đã đọc giữ nguyên (không cộng vào số "N tin nhắn mới"), được xoá dần bởi expire_read_notifications."""
+    removed = 0
+    while True:
+        groups = db.execute(text("""
+            SELECT user_id, from_user_id, MAX(noti_id) AS keep_id,
+                   SUM(agg_count) AS total, COUNT(*) AS cnt
+            FROM notifications
+            WHERE type = 'message' AND is_read = 0
+            GROUP BY user_id, from_user_id
+            HAVING COUNT(*) > 1
+            LIMIT :batch
+        """), {"batch": BATCH_SIZE}).fetchall()
+        if not groups:
+            return removed
+
+        for g in groups:
+            db.execute(text("""
+                UPDATE notifications
+                SET agg_count = :total, content = :content
+                WHERE noti_id = :keep_id
+            """), {
+                "total": g.total,
+                "content": aggregated_message_content(g.total),
+                "keep_id": g.keep_id,
+            })
+            db.execute(text("""
+                DELETE FROM notifications
+                WHERE type = 'message' AND is_read = 0 AND user_id = :uid AND from_user_id = :fid
+                  AND noti_id < :keep_id
+            """), {"uid": g.user_id, "fid": g.from_user_id, "keep_id": g.keep_id})
+            removed += g.cnt - 1
+        db.commit()
+
+        # Số dòng chưa đọc thay đổi → đếm lại badge khi cần
+        for uid in {g.user_id for g in groups}:
+            unread_counters.invalidate(uid)
+
+
+def expire_read_notifications(db: Session, now: Optional[datetime] = None) -> int:
+    """Xoá thông báo đã đọc quá READ_RETENTION_DAYS ngày"""
+    cutoff = (now or datetime.now()) - timedelta(days=READ_RETENTION_DAYS)
+    removed = 0
+    while True:
+        ids = [r.noti_id for r in db.execute(text("""
+            SELECT noti_id FROM notifications
+            WHERE is_read = 1 AND created_at < :cutoff
+            LIMIT :batch
+        """), {"cutoff": cutoff, "batch": BATCH_SIZE}).fetchall()]
+        if not ids:
+            return removed
+        db.execute(
+            text("DELETE FROM notifications WHERE noti_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids},
+        )
+        db.commit()
+        removed += len(ids)
+
+
+def compact_notifications() -> dict:
+    """1 lượt dọn dẹp (session riêng, dùng cho job nền và API admin).
+    Worker khác đang dọn → bỏ qua lượt này (skipped=True)."""
+    # Khoá giữ trên 1 kết nối riêng suốt lượt dọn (Session trả kết nối về pool sau mỗi commit)
+    with engine.connect() as lock_conn:
+        got = lock_conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": COMPACTION_LOCK_NAME}).scalar()
+        if got != 1:
+            return {"collapsed": 0, "expired": 0, "skipped": True}
+        try:
+            db = SessionLocal()
+            try:
+                collapsed = collapse_message_notifications(db)
+                expired = expire_read_notifications(db)
+                return {"collapsed": collapsed, "expired": expired, "skipped": False}
+            finally:
+                db.close()
+        finally:
+            lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": COMPACTION_LOCK_NAME})
+
+
+async def compaction_loop():
+    """Chạy nền từ sự kiện startup của app"""
+    while True:
+        try:
+            result = await asyncio.to_thread(compact_notifications)
+            if result["collapsed"] or result["expired"]:
+                print(f"🧹 Dọn thông báo: {result}")
+        except Exception as e:
+            print(f"⚠️ Lỗi dọn thông báo: {e}")
+        await asyncio.sleep(COMPACTION_INTERVAL_SECONDS)
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, FrozenSet
+
+from sqlalchemy import text
+
+from database import SessionLocal
+from services.broker import RedisBroker, broker
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+FLUSH_INTERVAL_SECONDS = 30    # Ghi last_seen_at xuống DB theo lô mỗi 30 giây
+SYNC_INTERVAL_SECONDS = 5      # Nhiều worker (BROKER_URL=redis://): đồng bộ tập user online qua Redis
+SYNC_KEY_PREFIX = "presence:worker:"
+
+
+class Presence:
+    """
+    Trạng thái online trong RAM, dựa trên kết nối WebSocket (chat / gọi / chat sự kiện / badge):
+    online = đang có ≥ 1 socket mở. Mỗi frame client gửi lên là 1 heartbeat.
+    last_seen chỉ ghi DB theo lô (flush) → không còn ghi users.is_online mỗi lần login / logout / 401.
+    Chạy nhiều worker: mỗi worker ghi tập user online của mình lên Redis (key có TTL, worker chết tự hết hạn)
+    và đọc lại hợp của mọi worker mỗi SYNC_INTERVAL_SECONDS → is_online / online_count trễ tối đa vài giây.
+    """
+
+    def __init__(self):
+        self._connections: Dict[int, int] = {}        # user_id → số socket đang mở ở worker này
+        self._dirty: Dict[int, datetime] = {}         # user_id → last_seen chưa ghi DB
+        self._cluster: FrozenSet[int] = frozenset()   # user online ở mọi worker (lần đồng bộ gần nhất)
+        self._local_only = 0                          # Số user có socket ở worker này nhưng chưa có trong _cluster
+        self._worker_key = SYNC_KEY_PREFIX + uuid.uuid4().hex
+        self._lock = threading.Lock()
+
+    def connect(self, user_id: int):
+        with self._lock:
+            opened = self._connections.get(user_id, 0)
+            self._connections[user_id] = opened + 1
+            if opened == 0 and user_id not in self._cluster:
+                self._local_only += 1
+            self._dirty[user_id] = datetime.now()
+
+    def disconnect(self, user_id: int):
+        with self._lock:
+            left = self._connections.get(user_id, 0) - 1
+            if left > 0:
+                self._connections[user_id] = left
+            elif self._connections.pop(user_id, None) is not None and user_id not in self._cluster:
+                self._local_only -= 1
+            self._dirty[user_id] = datetime.now()
+
+    def heartbeat(self, user_id: int):
+        with self._lock:
+            self._dirty[user_id] = datetime.now()
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._connections or user_id in self._cluster
+
+    def online_count(self) -> int:
+        # O(1): đếm sẵn khi connect / disconnect / đồng bộ, không dựng tập hợp mỗi lần gọi
+        with self._lock:
+            return len(self._cluster) + self._local_only
+
+    async def sync_cluster(self, client):
+        """Ghi tập user online của worker này lên Redis, đọc hợp của mọi worker còn sống"""
+        with self._lock:
+            local = list(self._connections)
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(self._worker_key)
+        if local:
+            pipe.sadd(self._worker_key, *local)
+            pipe.expire(self._worker_key, SYNC_INTERVAL_SECONDS * 3)
+        await pipe.execute()
+
+        keys = [k async for k in client.scan_iter(match=SYNC_KEY_PREFIX + "*")]
+        members = await client.sunion(keys) if keys else set()
+        cluster = frozenset(int(m) for m in members)
+        with self._lock:
+            self._cluster = cluster
+            self._local_only = sum(1 for uid in self._connections if uid not in cluster)
+
+    async def leave_cluster(self, client):
+        """Gọi khi tắt worker: xoá ngay tập của worker này thay vì chờ TTL"""
+        await client.delete(self._worker_key)
+
+    def flush(self) -> int:
+        """Ghi last_seen_at của các user vừa hoạt động (1 lệnh executemany, 1 commit)"""
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+        if not pending:
+            return 0
+
+        db = SessionLocal()
+        try:
+            db.execute(
+                text("UPDATE users SET last_seen_at = :seen WHERE user_id = :uid"),
+                [{"uid": uid, "seen": seen} for uid, seen in pending.items()],
+            )
+            db.commit()
+        except Exception:
+            # Ghi lỗi → trả lại để lần sau ghi (giữ giá trị mới hơn nếu có)
+            with self._lock:
+                for uid, seen in pending.items():
+                    self._dirty.setdefault(uid, seen)
+            raise
+        finally:
+            db.close()
+        return len(pending)
+
+
+presence = Presence()
+
+
+async def presence_flush_loop():
+    """Chạy nền từ sự kiện startup của app"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(presence.flush)
+        except Exception as e:
+            print(f"⚠️ Lỗi ghi last_seen: {e}")
+
+
+async def presence_sync_loop():
+    """Chạy nền từ sự kiện startup; chỉ cần khi dùng Redis broker (nhiều worker)"""
+    if not isinstance(broker, RedisBroker):
+        return
+    while True:
+        try:
+            await presence.sync_cluster(broker.client)
+        except Exception as e:
+            print(f"⚠️ Lỗi đồng bộ presence: {e}")
+        await asyncio.sleep(SYNC_INTERVAL_SECONDS)
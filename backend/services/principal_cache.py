@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from models.user_model import User
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+PRINCIPAL_TTL_SECONDS = 30     # Hết hạn → đọc lại users (bắt kịp ban / sửa hồ sơ từ worker khác)
+MAX_CACHED_PRINCIPALS = 100_000
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Thông tin user đăng nhập mà các API cần (thay cho đối tượng ORM User ở get_current_user)"""
+    user_id: int
+    email: str
+    full_name: str
+    gender: Any
+    role: str
+    is_admin: bool
+    is_banned: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            user_id=user.user_id,
+            email=user.email,
+            full_name=user.full_name,
+            gender=user.gender,
+            role=user.role or "user",
+            is_admin=bool(user.is_admin),
+            is_banned=bool(user.is_banned),
+        )
+
+
+class PrincipalCache:
+    """user_id → Principal, nạp lười từ users (theo khoá chính), TTL ngắn + LRU"""
+
+    def __init__(self):
+        self._by_id: "OrderedDict[int, tuple]" = OrderedDict()  # user_id → (Principal, loaded_at)
+        self._id_by_email: Dict[str, int] = {}                  # cho token cũ chỉ có sub=email
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id: Optional[int]) -> Optional[Principal]:
+        with self._lock:
+            hit = self._by_id.get(user_id)
+            if hit is not None and time.monotonic() - hit[1] <= PRINCIPAL_TTL_SECONDS:
+                self._by_id.move_to_end(user_id)
+                return hit[0]
+        return None
+
+    def _store(self, user: Optional[User]) -> Optional[Principal]:
+        if user is None:
+            return None
+        principal = Principal.from_user(user)
+        with self._lock:
+            self._by_id[principal.user_id] = (principal, time.monotonic())
+            self._id_by_email[principal.email] = principal.user_id
+            while len(self._by_id) > MAX_CACHED_PRINCIPALS:
+                _, (old, _) = self._by_id.popitem(last=False)
+                self._id_by_email.pop(old.email, None)
+        return principal
+
+    def get_by_id(self, db: Session, user_id: int) -> Optional[Principal]:
+        return self._cached(user_id) or self._store(db.get(User, user_id))
+
+    def get_by_email(self, db: Session, email: str) -> Optional[Principal]:
+        principal = self._cached(self._id_by_email.get(email))
+        if principal is not None and principal.email == email:
+            return principal
+        return self._store(db.query(User).filter(User.email == email).first())
+
+    def resolve(self, db: Session, payload: dict) -> Optional[Principal]:
+        """User của token: ưu tiên claim uid (khoá chính), token cũ chỉ có sub=email thì tra theo email"""
+        uid = payload.get("uid")
+        if uid is not None:
+            return self.get_by_id(db, int(uid))
+        email = payload.get("sub")
+        if email is None:
+            return None
+        return self.get_by_email(db, email)
+
+    def invalidate(self, user_id: int):
+        """Gọi sau khi commit thay đổi ban / hồ sơ của user"""
+        with self._lock:
+            hit = self._by_id.pop(user_id, None)
+            if hit is not None:
+                self._id_by_email.pop(hit[0].email, None)
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,217 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services import conversation_summary
+from services.candidate_index import candidate_index
+from services.exclusion_index import exclusion_index
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+MAX_RANDOM_PROBES = 32         # Số lần bốc ngẫu nhiên trước khi chuyển sang quét tuần tự
+MAX_INSERT_ATTEMPTS = 3        # Cặp vừa bị người khác ghép trước → thử người khác
+QUEUE_TIMEOUT_SECONDS = 60     # Chờ quá lâu trong hàng đợi → tự rời
+RESULT_TTL_SECONDS = 120       # Giữ kết quả ghép cho người đang chờ đọc lại
+
+# Giới tính mình → giới tính cần tìm (giống điều kiện SQL cũ)
+TARGET_GENDER = {"male": "female", "female": "male", "other": "other"}
+
+
+def gender_value(gender) -> Optional[str]:
+    # ⭐ FIX ENUM → STRING
+    if hasattr(gender, "value"):
+        return gender.value
+    return gender
+
+
+# ===============================
+# 🎲 CHỌN NGẪU NHIÊN TỪ POOL TRONG RAM
+# ===============================
+def pick_random_target(db: Session, user_id: int, gender: Optional[str],
+                       tried: frozenset = frozenset()) -> Optional[int]:
+    """Bốc ngẫu nhiên theo vị trí trong pool giới tính, loại người đã match (không quét bảng users)"""
+    target_gender = TARGET_GENDER.get(gender)
+    if target_gender is None:
+        return None
+    pool = candidate_index.gender_pool(db, target_gender)
+    if not pool:
+        return None
+    matched = exclusion_index.get(db, user_id).matched
+
+    def eligible(cid: int) -> bool:
+        return cid != user_id and cid not in matched and cid not in tried
+
+    # ✅ 1. Bốc ngẫu nhiên (hầu hết trường hợp trúng ngay vài lần đầu)
+    for _ in range(min(MAX_RANDOM_PROBES, len(pool))):
+        cid = pool[random.randrange(len(pool))]
+        if eligible(cid):
+            return cid
+
+    # ✅ 2. Gần như ai cũng đã match → quét vòng từ 1 vị trí ngẫu nhiên
+    start = random.randrange(len(pool))
+    for i in range(len(pool)):
+        cid = pool[(start + i) % len(pool)]
+        if eligible(cid):
+            return cid
+    return None
+
+
+def create_match(db: Session, user_id: int, target_id: int) -> Optional[int]:
+    """Tạo match, trả về match_id (lastrowid); None nếu cặp này đã có match"""
+    inserted = db.execute(text("""
+        INSERT IGNORE INTO matches (user1_id, user2_id, status)
+        VALUES (:u1, :u2, 'active')
+    """), {"u1": user_id, "u2": target_id})
+    match_id = inserted.lastrowid if inserted.rowcount == 1 else None
+    if match_id is not None:
+        conversation_summary.on_match_created(db, match_id, user_id, target_id)
+    db.commit()
+    exclusion_index.on_match(user_id, target_id)
+    return match_id
+
+
+def fetch_matched_user(db: Session, target_id: int) -> Optional[dict]:
+    """Tên + avatar của 1 user (tra theo khóa chính, không subquery theo từng dòng)"""
+    row = db.execute(text("""
+        SELECT u.user_id, u.full_name, p.url AS avatar
+        FROM users u
+        LEFT JOIN photos p ON p.user_id = u.user_id AND p.is_avatar = 1
+        WHERE u.user_id = :tid
+        LIMIT 1
+    """), {"tid": target_id}).fetchone()
+    if not row:
+        return None
+    return {"user_id": row.user_id, "full_name": row.full_name, "avatar": row.avatar}
+
+
+def random_match_now(db: Session, user_id: int, gender) -> Optional[dict]:
+    """Ghép ngay với 1 người ngẫu nhiên; None nếu không còn ai phù hợp"""
+    gender = gender_value(gender)
+    tried = set()
+    for _ in range(MAX_INSERT_ATTEMPTS):
+        target_id = pick_random_target(db, user_id, gender, frozenset(tried))
+        if target_id is None:
+            return None
+        match_id = create_match(db, user_id, target_id)
+        if match_id is not None:
+            return {"match_id": match_id, "matched_user": fetch_matched_user(db, target_id)}
+        tried.add(target_id)
+    return None
+
+
+# ===============================
+# ⏳ HÀNG ĐỢI GHÉP ĐÔI (trong RAM, theo từng worker)
+# ===============================
+@dataclass
+class QueueTicket:
+    user_id: int
+    gender: str
+    joined_at: float
+
+
+class MatchmakingQueue:
+    """2 người cùng bấm 'ghép ngẫu nhiên' và đang chờ → ghép thẳng với nhau"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # giới tính của người chờ → (user_id → ticket), theo thứ tự vào hàng
+        self._waiting: Dict[str, "OrderedDict[int, QueueTicket]"] = {}
+        self._results: Dict[int, tuple] = {}   # user_id → (kết quả ghép, thời điểm)
+
+    def _purge(self, now: float):
+        for tickets in self._waiting.values():
+            while tickets:
+                ticket = next(iter(tickets.values()))
+                if now - ticket.joined_at <= QUEUE_TIMEOUT_SECONDS:
+                    break
+                tickets.popitem(last=False)
+        for uid in [u for u, (_, at) in self._results.items() if now - at > RESULT_TTL_SECONDS]:
+            del self._results[uid]
+
+    def _requeue(self, ticket: QueueTicket):
+        """Trả ticket về đúng chỗ theo joined_at (_purge dựa vào thứ tự vào hàng: cũ nhất ở đầu)"""
+        tickets = self._waiting.setdefault(ticket.gender, OrderedDict())
+        newer = [uid for uid, t in tickets.items() if t.joined_at > ticket.joined_at]
+        tickets[ticket.user_id] = ticket
+        for uid in newer:
+            tickets.move_to_end(uid)
+
+    def _take_partner(self, user_id: int, gender: str, matched) -> Optional[QueueTicket]:
+        tickets = self._waiting.get(TARGET_GENDER[gender])
+        if not tickets:
+            return None
+        for uid, ticket in tickets.items():
+            if uid != user_id and uid not in matched:
+                del tickets[uid]
+                return ticket
+        return None
+
+    def join(self, db: Session, user_id: int, gender) -> dict:
+        gender = gender_value(gender)
+        if gender not in TARGET_GENDER:
+            return {"status": "invalid"}
+        matched = exclusion_index.get(db, user_id).matched
+        now = time.monotonic()
+
+        with self._lock:
+            self._purge(now)
+            self._results.pop(user_id, None)
+            partner = self._take_partner(user_id, gender, matched)
+            if partner is None:
+                self._waiting.setdefault(gender, OrderedDict())[user_id] = QueueTicket(user_id, gender, now)
+                return {"status": "waiting"}
+
+        match_id = create_match(db, user_id, partner.user_id)
+        if match_id is None:
+            # Cặp vừa có match ở nơi khác → mình vào hàng chờ, người kia giữ nguyên chỗ
+            with self._lock:
+                self._requeue(partner)
+                self._waiting.setdefault(gender, OrderedDict())[user_id] = QueueTicket(user_id, gender, now)
+            return {"status": "waiting"}
+
+        for_partner = {
+            "status": "matched",
+            "match_id": match_id,
+            "matched_user": fetch_matched_user(db, user_id),
+        }
+        with self._lock:
+            self._results[partner.user_id] = (for_partner, time.monotonic())
+        return {
+            "status": "matched",
+            "match_id": match_id,
+            "matched_user": fetch_matched_user(db, partner.user_id),
+        }
+
+    def status(self, user_id: int) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            result = self._results.pop(user_id, None)
+            if result is not None:
+                return result[0]
+            for tickets in self._waiting.values():
+                ticket = tickets.get(user_id)
+                if ticket is not None:
+                    return {"status": "waiting", "waited_seconds": int(now - ticket.joined_at)}
+        return {"status": "idle"}
+
+    def leave(self, user_id: int) -> bool:
+        with self._lock:
+            for tickets in self._waiting.values():
+                if tickets.pop(user_id, None) is not None:
+                    return True
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {gender: len(tickets) for gender, tickets in self._waiting.items()}
+
+
+matchmaking_queue = MatchmakingQueue()
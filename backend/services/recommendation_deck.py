@@ -0,0 +1,276 @@
+import itertools
+import random
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from services.candidate_index import candidate_index
+from services.compat_scoring import rank_candidates
+from services.exclusion_index import exclusion_index
+
+# ===============================
+# ⚙️ CẤU HÌNH DECK
+# ===============================
+DECK_BATCH_SIZE = 200       # Số ứng viên lấy mỗi lần nạp deck
+DECK_LOW_WATERMARK = 20     # Còn ít hơn số này → nạp thêm ở background
+DECK_TTL_SECONDS = 600      # Deck cũ hơn 10 phút sẽ được build lại
+MAX_DECKS = 10_000          # Giới hạn số deck giữ trong RAM (LRU)
+RANKED_POOL_LIMIT = 5_000   # Chế độ xếp hạng: chấm điểm tối đa ngần này ứng viên
+
+_generations = itertools.count(1)
+
+
+@dataclass(frozen=True)
+class DeckFilters:
+    """Bộ lọc gợi ý (dùng làm key của deck)"""
+    gender: Optional[str]
+    min_birth: date
+    max_birth: date
+    city: Optional[str]
+    interest: Optional[str]
+    ranked: bool = False         # True → sắp theo điểm tương hợp thay vì xáo ngẫu nhiên
+
+
+@dataclass
+class Deck:
+    """Danh sách ID ứng viên đã xáo trộn của 1 user"""
+    ids: List[int] = field(default_factory=list)
+    base: int = 0                # Vị trí tuyệt đối của ids[0] (phần đầu đã phát bị cắt bớt)
+    pos: int = 0                 # Vị trí tuyệt đối của lá bài tiếp theo
+    generation: int = field(default_factory=lambda: next(_generations))
+    pivot: int = 0               # Điểm bắt đầu quét ngẫu nhiên theo user_id
+    cursor: int = 0              # user_id lớn nhất đã quét
+    wrapped: bool = False        # Đã quét hết đoạn [pivot, max] và quay về đầu
+    exhausted: bool = False      # Đã quét hết toàn bộ ứng viên
+    refilling: bool = False      # Đã hẹn nạp thêm ở background
+    refill_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    total: int = 0               # Tổng số người phù hợp tại thời điểm build
+    seen: int = 0                # Số người đã skip tại thời điểm build
+    served: int = 0              # Số lá bài đã phát từ deck
+    created_at: float = field(default_factory=time.monotonic)
+
+    def remaining(self) -> int:
+        return self.base + len(self.ids) - self.pos
+
+    def cursor_token(self) -> str:
+        return f"{self.generation}.{self.pos}"
+
+
+def _eligible_pool(db: Session, user_id: int, filters: DeckFilters) -> List[int]:
+    """ID khớp bộ lọc (tăng dần) lấy từ candidate index thay vì LIKE '%x%' trên bảng users"""
+    pool = candidate_index.query(
+        db, filters.gender, filters.min_birth, filters.max_birth,
+        city=filters.city, interest=filters.interest,
+    )
+    i = bisect_left(pool, user_id)
+    if i < len(pool) and pool[i] == user_id:
+        del pool[i]
+    return pool
+
+
+def _next_batch(db: Session, user_id: int, filters: DeckFilters, deck: Deck) -> List[int]:
+    """Lấy batch ứng viên tiếp theo: quét từ pivot → max, sau đó quay về 0 → pivot"""
+    excluded = exclusion_index.get(db, user_id)
+    pool = _eligible_pool(db, user_id, filters)
+    batch: List[int] = []
+    while len(batch) < DECK_BATCH_SIZE and not deck.exhausted:
+        start = bisect_right(pool, deck.cursor)
+        stop = bisect_right(pool, deck.pivot) if deck.wrapped else len(pool)
+        page = pool[start:min(start + DECK_BATCH_SIZE, stop)]
+        batch.extend(cid for cid in page if not excluded.excludes(cid))
+        if page:
+            deck.cursor = page[-1]
+        if start + len(page) >= stop:
+            if deck.wrapped or deck.pivot == 0:
+                deck.exhausted = True
+            else:
+                deck.wrapped = True
+                deck.cursor = 0
+    random.shuffle(batch)
+    return batch
+
+
+def _build_ranked_deck(db: Session, user_id: int, filters: DeckFilters) -> Deck:
+    """Deck xếp hạng: chấm điểm toàn bộ ứng viên 1 lần, phát theo điểm giảm dần"""
+    excluded = exclusion_index.get(db, user_id)
+    eligible = [cid for cid in _eligible_pool(db, user_id, filters) if not excluded.excludes(cid)]
+    total = len(eligible)
+    if total > RANKED_POOL_LIMIT:
+        eligible = random.sample(eligible, RANKED_POOL_LIMIT)
+
+    me = candidate_index.profiles([user_id])
+    deck = Deck(total=total, seen=len(excluded.skipped), exhausted=True)
+    deck.ids = rank_candidates(me[0] if me else None, candidate_index.profiles(eligible))
+    return deck
+
+
+def _build_deck(db: Session, user_id: int, filters: DeckFilters) -> Deck:
+    if filters.ranked:
+        return _build_ranked_deck(db, user_id, filters)
+
+    excluded = exclusion_index.get(db, user_id)
+    pool = _eligible_pool(db, user_id, filters)
+
+    # ✅ Đếm tổng 1 lần khi build (thay vì mỗi lần quẹt)
+    total = sum(1 for cid in pool if not excluded.excludes(cid))
+    seen = len(excluded.skipped)
+
+    deck = Deck(total=total, seen=seen)
+    deck.pivot = random.randint(0, pool[-1]) if total else 0
+    deck.cursor = deck.pivot
+    if total:
+        deck.ids = _next_batch(db, user_id, filters, deck)
+    else:
+        deck.exhausted = True
+    return deck
+
+
+class DeckStore:
+    """Lưu deck gợi ý của từng user trong RAM, phát lá bài O(1)"""
+
+    def __init__(self):
+        self._decks: "OrderedDict[tuple, Deck]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: tuple) -> Optional[Deck]:
+        deck = self._decks.get(key)
+        if deck is None:
+            return None
+        if time.monotonic() - deck.created_at > DECK_TTL_SECONDS:
+            del self._decks[key]
+            return None
+        self._decks.move_to_end(key)
+        return deck
+
+    def _put(self, key: tuple, deck: Deck):
+        self._decks[key] = deck
+        self._decks.move_to_end(key)
+        while len(self._decks) > MAX_DECKS:
+            self._decks.popitem(last=False)
+
+    def get_or_build(self, db: Session, user_id: int, filters: DeckFilters) -> Deck:
+        key = (user_id, filters)
+        with self._lock:
+            deck = self._get(key)
+        if deck is not None and (deck.remaining() > 0 or not deck.exhausted):
+            return deck
+
+        deck = _build_deck(db, user_id, filters)
+        with self._lock:
+            self._put(key, deck)
+        return deck
+
+    def take(self, deck: Deck) -> Optional[int]:
+        page = self.take_page(deck, None, 1)
+        return page[0] if page else None
+
+    def take_page(self, deck: Deck, cursor: Optional[str], limit: int) -> List[int]:
+        """Lấy 1 trang ID bắt đầu từ cursor (gửi lại cùng cursor → cùng trang)"""
+        with self._lock:
+            start = _parse_cursor(deck, cursor)
+            offset = start - deck.base
+            page = deck.ids[offset:offset + limit]
+            end = start + len(page)
+            if end > deck.pos:
+                deck.served += end - deck.pos
+                deck.pos = end
+            # Dọn phần đã phát (giữ lại 1 batch để client retry trang trước)
+            keep_from = deck.pos - deck.base - DECK_BATCH_SIZE
+            if keep_from >= DECK_BATCH_SIZE:
+                del deck.ids[:keep_from]
+                deck.base += keep_from
+            return page
+
+    def needs_refill(self, deck: Deck, want: int = DECK_LOW_WATERMARK) -> bool:
+        with self._lock:
+            if deck.exhausted or deck.refilling or deck.remaining() >= want:
+                return False
+            deck.refilling = True
+            return True
+
+    def refill(self, user_id: int, filters: DeckFilters):
+        """Nạp thêm ứng viên (chạy ở background với session riêng)"""
+        with self._lock:
+            deck = self._decks.get((user_id, filters))
+        if deck is None:
+            return
+
+        db = SessionLocal()
+        try:
+            self.refill_now(db, user_id, filters, deck)
+        except Exception as e:
+            print(f"⚠️ Lỗi nạp deck cho user {user_id}: {e}")
+        finally:
+            db.close()
+
+    def refill_now(self, db: Session, user_id: int, filters: DeckFilters, deck: Deck,
+                   want: int = DECK_LOW_WATERMARK):
+        """Nạp thêm ứng viên ngay trong request hiện tại (đang có lượt nạp khác của deck → chờ xong rồi xét lại)"""
+        try:
+            with deck.refill_lock:
+                if not deck.exhausted and deck.remaining() < want:
+                    batch = _next_batch(db, user_id, filters, deck)
+                    with self._lock:
+                        deck.ids.extend(batch)
+        finally:
+            # Lỗi cũng phải gỡ cờ, nếu không deck không bao giờ được nạp lại tới khi hết TTL
+            with self._lock:
+                deck.refilling = False
+
+    def invalidate(self, user_id: int):
+        """Xoá mọi deck của user (vd: khi gỡ skip để người đó quay lại)"""
+        with self._lock:
+            for key in [k for k in self._decks if k[0] == user_id]:
+                del self._decks[key]
+
+
+def _parse_cursor(deck: Deck, cursor: Optional[str]) -> int:
+    """Cursor dạng "<generation>.<pos>"; cursor sai/cũ → bắt đầu từ vị trí hiện tại"""
+    if cursor:
+        try:
+            generation, pos = (int(x) for x in cursor.split(".", 1))
+        except ValueError:
+            return deck.pos
+        if generation == deck.generation and deck.base <= pos <= deck.pos:
+            return pos
+    return deck.pos
+
+
+deck_store = DeckStore()
+
+
+def fetch_card(db: Session, candidate_id: int):
+    return db.execute(text("""
+        SELECT u.user_id, u.full_name, u.gender, u.city, u.bio, u.birthday,
+               p.url AS avatar_url
+        FROM users u
+        LEFT JOIN photos p ON u.user_id = p.user_id AND p.is_avatar = 1
+        WHERE u.user_id = :cid
+        LIMIT 1
+    """), {"cid": candidate_id}).fetchone()
+
+
+def fetch_cards(db: Session, candidate_ids: List[int]) -> List[dict]:
+    """Lấy thông tin + avatar của nhiều ứng viên trong 1 truy vấn (giữ đúng thứ tự deck)"""
+    if not candidate_ids:
+        return []
+    rows = db.execute(text("""
+        SELECT u.user_id, u.full_name, u.gender, u.city, u.bio, u.birthday,
+               p.url AS avatar_url
+        FROM users u
+        LEFT JOIN photos p ON u.user_id = p.user_id AND p.is_avatar = 1
+        WHERE u.user_id IN :ids
+    """).bindparams(bindparam("ids", expanding=True)), {"ids": candidate_ids}).fetchall()
+
+    by_id = {}
+    for r in rows:
+        by_id.setdefault(r.user_id, dict(r._mapping))
+    return [by_id[cid] for cid in candidate_ids if cid in by_id]
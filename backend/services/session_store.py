@@ -0,0 +1,111 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from typing import Optional, Tuple
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+# sqlite:///sessions.db → lưu ra file, còn nguyên khi restart (mặc định)
+# sqlite://             → chỉ trong RAM (mất khi restart, dùng khi thử nghiệm)
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "sqlite:///sessions.db")
+REFRESH_TOKEN_TTL_SECONDS = 30 * 24 * 3600   # Refresh token sống 30 ngày
+
+
+def _hash(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+class SessionStore:
+    """
+    Phiên đăng nhập cho refresh token (tách khỏi bảng users: hết hạn / 401 không ghi gì vào MySQL).
+    Refresh token = "<session_id>.<secret>", chỉ lưu hash của secret; mỗi lần refresh đổi secret mới,
+    dùng lại secret cũ (token bị lộ) → thu hồi cả phiên.
+    """
+
+    def __init__(self, url: str = SESSION_STORE_URL):
+        kwargs = {"connect_args": {"check_same_thread": False}}
+        if url in ("sqlite://", "sqlite:///:memory:"):
+            kwargs["poolclass"] = StaticPool  # 1 DB trong RAM dùng chung cho mọi thread
+        self._engine = create_engine(url, **kwargs)
+        self._lock = threading.Lock()
+        with self._engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id   TEXT PRIMARY KEY,
+                    user_id      INTEGER NOT NULL,
+                    secret_hash  TEXT NOT NULL,
+                    created_at   REAL NOT NULL,
+                    last_used_at REAL NOT NULL,
+                    expires_at   REAL NOT NULL,
+                    revoked      INTEGER NOT NULL DEFAULT 0
+                )
+            """))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_user ON sessions (user_id)"))
+        self.purge_expired()  # Dọn phiên cũ mỗi lần khởi động
+
+    def create(self, user_id: int) -> str:
+        """Tạo phiên mới khi đăng nhập, trả về refresh token"""
+        session_id, secret = secrets.token_urlsafe(16), secrets.token_urlsafe(32)
+        now = time.time()
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO sessions (session_id, user_id, secret_hash, created_at, last_used_at, expires_at)
+                VALUES (:sid, :uid, :hash, :now, :now, :exp)
+            """), {"sid": session_id, "uid": user_id, "hash": _hash(secret),
+                   "now": now, "exp": now + REFRESH_TOKEN_TTL_SECONDS})
+        return f"{session_id}.{secret}"
+
+    def rotate(self, refresh_token: str) -> Optional[Tuple[int, str]]:
+        """Đổi refresh token cũ lấy token mới; trả về (user_id, refresh token mới) hoặc None nếu không hợp lệ"""
+        session_id, _, secret = (refresh_token or "").partition(".")
+        if not session_id or not secret:
+            return None
+        now = time.time()
+        new_secret = secrets.token_urlsafe(32)
+        with self._lock, self._engine.begin() as conn:
+            row = conn.execute(text("""
+                SELECT user_id, secret_hash, expires_at, revoked FROM sessions WHERE session_id = :sid
+            """), {"sid": session_id}).fetchone()
+            if row is None or row.revoked or row.expires_at < now:
+                return None
+            if not secrets.compare_digest(row.secret_hash, _hash(secret)):
+                # Secret cũ bị dùng lại → có thể đã lộ: khoá luôn phiên này
+                conn.execute(text("UPDATE sessions SET revoked = 1 WHERE session_id = :sid"), {"sid": session_id})
+                return None
+            conn.execute(text("""
+                UPDATE sessions
+                SET secret_hash = :hash, last_used_at = :now, expires_at = :exp
+                WHERE session_id = :sid
+            """), {"sid": session_id, "hash": _hash(new_secret),
+                   "now": now, "exp": now + REFRESH_TOKEN_TTL_SECONDS})
+        return row.user_id, f"{session_id}.{new_secret}"
+
+    def revoke(self, refresh_token: str):
+        """Đăng xuất 1 thiết bị (phải đúng cả secret, không chỉ session_id)"""
+        session_id, _, secret = (refresh_token or "").partition(".")
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE sessions SET revoked = 1 WHERE session_id = :sid AND secret_hash = :hash
+            """), {"sid": session_id, "hash": _hash(secret)})
+
+    def revoke_user(self, user_id: int):
+        """Thu hồi mọi phiên của user (vd: bị admin khoá)"""
+        with self._lock, self._engine.begin() as conn:
+            conn.execute(text("UPDATE sessions SET revoked = 1 WHERE user_id = :uid AND revoked = 0"),
+                         {"uid": user_id})
+
+    def purge_expired(self) -> int:
+        """Xoá phiên đã hết hạn / đã thu hồi"""
+        with self._lock, self._engine.begin() as conn:
+            result = conn.execute(text("DELETE FROM sessions WHERE revoked = 1 OR expires_at < :now"),
+                                  {"now": time.time()})
+        return result.rowcount
+
+
+session_store = SessionStore()
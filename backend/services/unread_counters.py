@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services import conversation_summary
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+COUNTERS_TTL_SECONDS = 60      # Hết hạn → đếm lại từ DB (bắt kịp ghi từ worker khác)
+MAX_CACHED_USERS = 100_000     # Giới hạn số user giữ trong RAM (LRU)
+
+
+class _Entry:
+    __slots__ = ("notifications", "messages", "loaded_at")
+
+    def __init__(self, notifications: int, messages: int):
+        self.notifications = notifications
+        self.messages = messages
+        self.loaded_at = time.monotonic()
+
+
+def _load_from_db(db: Session, user_id: int) -> _Entry:
+    notifications = db.execute(text("""
+        SELECT COUNT(*) FROM notifications
+        WHERE user_id = :uid AND is_read = 0
+    """), {"uid": user_id}).scalar() or 0
+
+    # Số tin chưa đọc theo từng match đã nằm sẵn trong conversation_summaries
+    conversation_summary.ensure_backfilled(db, user_id)
+    messages = db.execute(text("""
+        SELECT COALESCE(SUM(unread_count), 0) FROM conversation_summaries
+        WHERE user_id = :uid
+    """), {"uid": user_id}).scalar() or 0
+    return _Entry(int(notifications), int(messages))
+
+
+class UnreadCounters:
+    """Số thông báo / tin nhắn chưa đọc của từng user, nạp lười rồi cộng trừ khi ghi"""
+
+    def __init__(self):
+        self._users: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: int) -> dict:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and time.monotonic() - entry.loaded_at <= COUNTERS_TTL_SECONDS:
+                self._users.move_to_end(user_id)
+                return self._as_dict(entry)
+
+        entry = _load_from_db(db, user_id)
+        with self._lock:
+            self._users[user_id] = entry
+            while len(self._users) > MAX_CACHED_USERS:
+                self._users.popitem(last=False)
+            return self._as_dict(entry)
+
+    def peek(self, user_id: int) -> Optional[dict]:
+        """Giá trị đang cache (còn hạn) hoặc None, không đọc DB"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or time.monotonic() - entry.loaded_at > COUNTERS_TTL_SECONDS:
+                return None
+            return self._as_dict(entry)
+
+    @staticmethod
+    def _as_dict(entry: _Entry) -> dict:
+        return {
+            "notifications": entry.notifications,
+            "messages": entry.messages,
+            "total": entry.notifications + entry.messages,
+        }
+
+    # ----------------------------- #
+    #  CẬP NHẬT SAU KHI COMMIT
+    #  (user chưa được nạp thì bỏ qua, lần sau sẽ đếm từ DB)
+    # ----------------------------- #
+    def on_notifications(self, user_ids: Iterable[int]):
+        with self._lock:
+            for uid in user_ids:
+                entry = self._users.get(uid)
+                if entry is not None:
+                    entry.notifications += 1
+
+    def on_notifications_read(self, user_id: int):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.notifications = 0
+
+    def on_message(self, receiver_id: int):
+        with self._lock:
+            entry = self._users.get(receiver_id)
+            if entry is not None:
+                entry.messages += 1
+
+    def on_delta(self, user_id: int, messages: int, notifications: int):
+        """Thay đổi do worker khác ghi (nhận qua broker)"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.messages += messages
+                entry.notifications += notifications
+
+    def on_conversation_read(self, user_id: int, cleared: int):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                entry.messages = max(entry.messages - cleared, 0)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+unread_counters = UnreadCounters()
+
+
+def mark_conversation_read(db: Session, match_id: int, user_id: int) -> int:
+    """Đánh dấu đã đọc toàn bộ tin của đối phương trong match, trả về số tin vừa được xoá khỏi badge"""
+    row = db.execute(text("""
+        SELECT unread_count FROM conversation_summaries
+        WHERE match_id = :mid AND user_id = :uid
+    """), {"mid": match_id, "uid": user_id}).fetchone()
+    cleared = row.unread_count if row else 0
+
+    db.execute(text("""
+        UPDATE messages SET is_read = 1
+        WHERE match_id = :mid AND sender_id != :uid AND is_read = 0
+    """), {"mid": match_id, "uid": user_id})
+    db.execute(text("""
+        UPDATE conversation_summaries SET unread_count = 0
+        WHERE match_id = :mid AND user_id = :uid
+    """), {"mid": match_id, "uid": user_id})
+    db.commit()
+
+    unread_counters.on_conversation_read(user_id, cleared)
+    return cleared
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, List, Optional, Set
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+# CHAT_WRITE_BEHIND=1 → tin chat được gửi realtime ngay, ghi DB theo lô ở nền (mặc định tắt: ghi rồi mới gửi)
+WRITE_BEHIND_ENABLED = os.getenv("CHAT_WRITE_BEHIND", "0") == "1"
+FLUSH_INTERVAL_SECONDS = 0.05  # Gom tối đa 50ms rồi ghi
+FLUSH_MAX_ROWS = 200           # Hoặc đủ 200 dòng thì ghi ngay
+RETRY_BASE_SECONDS = 0.5       # Ghi lỗi → thử lại sau 0.5s, 1s, 2s, ... (tối đa RETRY_MAX_SECONDS)
+RETRY_MAX_SECONDS = 30
+MAX_ATTEMPTS = 8               # 1 dòng lỗi quá số lần này → chuyển ra file dead-letter, không chặn hàng đợi
+SHUTDOWN_ATTEMPTS = 3          # Lúc tắt server: thử thêm vài lần rồi ghi phần còn lại ra file
+# Dòng không ghi được vào DB → lưu JSON lines ở đây để nhập lại bằng tay
+DEAD_LETTER_PATH = os.getenv("WRITE_BEHIND_DEAD_LETTER", "write_behind_failed.jsonl")
+
+FlushFn = Callable[[List[dict]], Awaitable[None]]
+
+
+class WriteBehindBuffer:
+    """
+    Bộ đệm ghi sau trong 1 process: append() không chờ DB, flush_fn nhận cả lô để INSERT nhiều dòng 1 lần.
+    Lô lỗi → ghi lại từng dòng (1 dòng hỏng không chặn cả lô); dòng vẫn lỗi được thử lại với backoff,
+    quá MAX_ATTEMPTS thì ghi ra file dead-letter. flush_all() khi tắt server.
+    """
+
+    def __init__(self, name: str, flush_fn: FlushFn,
+                 max_rows: int = FLUSH_MAX_ROWS, interval: float = FLUSH_INTERVAL_SECONDS):
+        self.name = name
+        self._flush_fn = flush_fn
+        self._max_rows = max_rows
+        self._interval = interval
+        self._rows: List[dict] = []
+        self._attempts: List[int] = []   # Số lần đã ghi lỗi của từng dòng trong _rows
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._retry: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()  # Giữ tham chiếu → task không bị GC giữa chừng
+        _buffers.append(self)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def append(self, row: dict):
+        self._rows.append(row)
+        self._attempts.append(0)
+        if len(self._rows) >= self._max_rows:
+            self._spawn(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self._spawn(self._flush_later(self._interval))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    def _schedule_retry(self, attempts: int):
+        # Task thử lại riêng (không dùng _timer: lúc này _timer có thể chính là task đang flush)
+        if self._retry is not None and not self._retry.done() and self._retry is not asyncio.current_task():
+            return
+        delay = min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+        self._retry = self._spawn(self._flush_later(delay))
+
+    async def _write(self, rows: List[dict], attempts: List[int]):
+        """Ghi 1 lô; trả về (dòng chưa ghi được, số lần lỗi tương ứng)"""
+        try:
+            await self._flush_fn(rows)
+            return [], []
+        except Exception as e:
+            print(f"⚠️ Write-behind {self.name}: ghi lô {len(rows)} dòng lỗi: {e}")
+        if len(rows) == 1:
+            return rows, [attempts[0] + 1]
+
+        # Lô lỗi → ghi lại từng dòng để tách dòng hỏng ra
+        failed, failed_attempts = [], []
+        for row, n in zip(rows, attempts):
+            try:
+                await self._flush_fn([row])
+            except Exception as e:
+                print(f"⚠️ Write-behind {self.name}: dòng lỗi (lần {n + 1}): {e}")
+                failed.append(row)
+                failed_attempts.append(n + 1)
+        return failed, failed_attempts
+
+    async def flush(self, max_attempts: int = MAX_ATTEMPTS):
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            attempts, self._attempts = self._attempts, []
+            if not rows:
+                return
+            failed, failed_attempts = await self._write(rows, attempts)
+            if not failed:
+                return
+
+            dead = [r for r, n in zip(failed, failed_attempts) if n >= max_attempts]
+            if dead:
+                await asyncio.to_thread(_dead_letter, self.name, dead)
+            retry = [(r, n) for r, n in zip(failed, failed_attempts) if n < max_attempts]
+            if retry:
+                # Trả về đầu hàng đợi (giữ thứ tự tin), hẹn giờ thử lại
+                self._rows[:0] = [r for r, _ in retry]
+                self._attempts[:0] = [n for _, n in retry]
+                self._schedule_retry(max(n for _, n in retry))
+
+    def pending(self) -> int:
+        return len(self._rows)
+
+    async def drain(self):
+        """Gọi khi tắt server: thử ghi vài lần (có backoff), phần còn lại ghi ra file dead-letter"""
+        for attempt in range(SHUTDOWN_ATTEMPTS):
+            await self.flush(max_attempts=MAX_ATTEMPTS + SHUTDOWN_ATTEMPTS)
+            if not self.pending():
+                break
+            await asyncio.sleep(min(RETRY_BASE_SECONDS * 2 ** attempt, RETRY_MAX_SECONDS))
+        async with self._lock:
+            # Giữ lock → không task nào đang ghi dở, huỷ các task hẹn giờ còn lại
+            for task in list(self._tasks):
+                if task is not asyncio.current_task():
+                    task.cancel()
+            rows, self._rows, self._attempts = self._rows, [], []
+        if rows:
+            await asyncio.to_thread(_dead_letter, self.name, rows)
+
+
+def _dead_letter(name: str, rows: List[dict]):
+    with open(DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({"buffer": name, "row": row}, ensure_ascii=False, default=str) + "\n")
+    print(f"❌ Write-behind {name}: {len(rows)} dòng không ghi được, đã lưu vào {DEAD_LETTER_PATH}")
+
+
+_buffers: List[WriteBehindBuffer] = []
+
+
+async def flush_all():
+    """Ghi hết mọi bộ đệm (gọi khi shutdown để không mất tin đã gửi realtime)"""
+    for buf in _buffers:
+        await buf.drain()
@@ -0,0 +1,215 @@
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+
+from services.notification_coalescer import aggregated_message_content
+
+# ==========================================
+# 🛠️ NÂNG CẤP SCHEMA (chạy lúc khởi động, idempotent)
+# create_all() chỉ tạo bảng mới, không thêm index/cột cho bảng đã có
+# ==========================================
+
+
+def _index_exists(conn: Connection, table: str, index_name: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = :t AND index_name = :i
+        LIMIT 1
+    """), {"t": table, "i": index_name}).fetchone() is not None
+
+
+def _column_exists(conn: Connection, table: str, column: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = :t AND column_name = :c
+        LIMIT 1
+    """), {"t": table, "c": column}).fetchone() is not None
+
+
+def _table_exists(conn: Connection, table: str) -> bool:
+    return conn.execute(text("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = :t
+        LIMIT 1
+    """), {"t": table}).fetchone() is not None
+
+
+def _primary_key(conn: Connection, table: str):
+    row = conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = :t AND column_key = 'PRI'
+        LIMIT 1
+    """), {"t": table}).fetchone()
+    return row[0] if row else None
+
+
+def ensure_column(conn: Connection, table: str, column: str, definition: str):
+    if not _column_exists(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+def ensure_index(conn: Connection, table: str, index_name: str, columns: str, unique: bool = False):
+    if not _index_exists(conn, table, index_name):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        conn.execute(text(f"CREATE {kind} {index_name} ON {table} ({columns})"))
+
+
+def _dedupe_pairs(conn: Connection, table: str, col_a: str, col_b: str):
+    """Xoá dòng trùng cặp (col_a, col_b), giữ dòng có khoá chính nhỏ nhất (trước khi tạo unique index)"""
+    pk = _primary_key(conn, table)
+    if pk is None:
+        return
+    removed = conn.execute(text(f"""
+        DELETE t FROM {table} t
+        JOIN {table} k ON k.{col_a} = t.{col_a} AND k.{col_b} = t.{col_b} AND k.{pk} < t.{pk}
+    """)).rowcount
+    if removed:
+        print(f"🧹 {table}: xoá {removed} dòng trùng cặp ({col_a}, {col_b})")
+
+
+def _dedupe_matches(conn: Connection):
+    """Gộp các match trùng cặp (A,B)/(B,A) về match_id nhỏ nhất; tin nhắn / cuộc gọi chuyển sang match giữ lại"""
+    groups = conn.execute(text("""
+        SELECT LEAST(user1_id, user2_id) AS lo, GREATEST(user1_id, user2_id) AS hi,
+               MIN(match_id) AS keep_id
+        FROM matches
+        GROUP BY LEAST(user1_id, user2_id), GREATEST(user1_id, user2_id)
+        HAVING COUNT(*) > 1
+    """)).fetchall()
+    children = ["messages", "calls"] if _table_exists(conn, "calls") else ["messages"]
+    for g in groups:
+        dups = [r.match_id for r in conn.execute(text("""
+            SELECT match_id FROM matches
+            WHERE LEAST(user1_id, user2_id) = :lo AND GREATEST(user1_id, user2_id) = :hi
+              AND match_id != :keep
+        """), {"lo": g.lo, "hi": g.hi, "keep": g.keep_id})]
+        params = {"keep": g.keep_id, "dups": dups}
+        for child in children:
+            conn.execute(text(f"UPDATE {child} SET match_id = :keep WHERE match_id IN :dups")
+                         .bindparams(bindparam("dups", expanding=True)), params)
+        # Dòng tóm tắt được dựng lại từ messages ở lần backfill tới
+        conn.execute(text("DELETE FROM conversation_summaries WHERE match_id IN :ids")
+                     .bindparams(bindparam("ids", expanding=True)), {"ids": [g.keep_id] + dups})
+        conn.execute(text("DELETE FROM matches WHERE match_id IN :dups")
+                     .bindparams(bindparam("dups", expanding=True)), params)
+    if groups:
+        print(f"🧹 matches: gộp {len(groups)} cặp bị trùng")
+
+
+def _likes_unique_pair(conn: Connection):
+    # 1 lượt like cho mỗi cặp (from → to) → INSERT IGNORE thay cho SELECT rồi INSERT
+    if not _index_exists(conn, "likes", "uq_likes_pair"):
+        _dedupe_pairs(conn, "likes", "from_user_id", "to_user_id")
+    ensure_index(conn, "likes", "uq_likes_pair", "from_user_id, to_user_id", unique=True)
+
+
+def _skips_unique_pair(conn: Connection):
+    # Cho phép ghi skip hàng loạt bằng INSERT IGNORE
+    if not _index_exists(conn, "skips", "uq_skips_pair"):
+        _dedupe_pairs(conn, "skips", "user_id", "target_user_id")
+    ensure_index(conn, "skips", "uq_skips_pair", "user_id, target_user_id", unique=True)
+
+
+def _matches_unique_pair(conn: Connection):
+    # Cặp không thứ tự (A,B) = (B,A) → cột sinh LEAST/GREATEST + unique để không bao giờ có 2 match
+    if not _index_exists(conn, "matches", "uq_matches_pair"):
+        _dedupe_matches(conn)
+    ensure_column(conn, "matches", "pair_low", "INT GENERATED ALWAYS AS (LEAST(user1_id, user2_id)) STORED")
+    ensure_column(conn, "matches", "pair_high", "INT GENERATED ALWAYS AS (GREATEST(user1_id, user2_id)) STORED")
+    ensure_index(conn, "matches", "uq_matches_pair", "pair_low, pair_high", unique=True)
+
+
+def _notifications_unread_index(conn: Connection):
+    # COUNT(*) chưa đọc cho badge chỉ quét index, không đọc cả lịch sử thông báo
+    ensure_index(conn, "notifications", "ix_notifications_user_read", "user_id, is_read")
+
+
+def _messages_history_index(conn: Connection):
+    # Lịch sử chat theo trang: WHERE match_id = ? AND message_id < ? ORDER BY message_id DESC
+    ensure_index(conn, "messages", "ix_messages_match_message", "match_id, message_id")
+
+
+def _event_messages_history_index(conn: Connection):
+    # Bảng event_messages tạo trước khi model khai báo index → thêm cho DB cũ
+    ensure_index(conn, "event_messages", "ix_event_messages_event_id_id", "event_id, id")
+
+
+def _notifications_feed_and_compaction(conn: Connection):
+    # agg_count: số thông báo đã được gộp vào dòng này (job dọn dẹp / gộp tin nhắn)
+    ensure_column(conn, "notifications", "agg_count", "INT NOT NULL DEFAULT 1")
+    # Feed theo trang: WHERE user_id = ? AND noti_id < ? ORDER BY noti_id DESC
+    ensure_index(conn, "notifications", "ix_notifications_user_noti", "user_id, noti_id")
+    # Xoá thông báo đã đọc quá hạn
+    ensure_index(conn, "notifications", "ix_notifications_read_created", "is_read, created_at")
+
+
+def _notifications_message_groups_index(conn: Connection):
+    # Job gộp thông báo: WHERE type = 'message' GROUP BY user_id, from_user_id chỉ quét index
+    ensure_index(conn, "notifications", "ix_notifications_type_user_from", "type, user_id, from_user_id")
+
+
+def _collapse_pending_messages(conn: Connection):
+    """Gộp các thông báo 'message' chưa đọc cùng cặp (người nhận, người gửi) về dòng mới nhất"""
+    groups = conn.execute(text("""
+        SELECT user_id, from_user_id, MAX(noti_id) AS keep_id, SUM(agg_count) AS total
+        FROM notifications
+        WHERE type = 'message' AND is_read = 0
+        GROUP BY user_id, from_user_id
+        HAVING COUNT(*) > 1
+    """)).fetchall()
+    for g in groups:
+        conn.execute(text("""
+            UPDATE notifications SET agg_count = :total, content = :content WHERE noti_id = :keep_id
+        """), {"total": g.total, "content": aggregated_message_content(g.total), "keep_id": g.keep_id})
+        conn.execute(text("""
+            DELETE FROM notifications
+            WHERE type = 'message' AND is_read = 0 AND user_id = :uid AND from_user_id = :fid
+              AND noti_id < :keep_id
+        """), {"uid": g.user_id, "fid": g.from_user_id, "keep_id": g.keep_id})
+
+
+def _notifications_pending_message_unique(conn: Connection):
+    # Tối đa 1 thông báo 'message' chưa đọc cho mỗi cặp → coalescer dùng INSERT ... ON DUPLICATE KEY UPDATE
+    # (cột sinh = NULL với dòng đã đọc / loại khác → không bị unique ràng buộc)
+    if not _index_exists(conn, "notifications", "uq_notifications_pending_message"):
+        _collapse_pending_messages(conn)
+    ensure_column(conn, "notifications", "pending_from",
+                  "INT GENERATED ALWAYS AS (IF(type = 'message' AND is_read = 0, from_user_id, NULL)) STORED")
+    ensure_index(conn, "notifications", "uq_notifications_pending_message", "user_id, pending_from", unique=True)
+
+
+def _users_last_seen(conn: Connection):
+    # Lần hoạt động cuối (presence ghi theo lô) thay cho cờ is_online
+    ensure_column(conn, "users", "last_seen_at", "DATETIME NULL")
+
+
+SCHEMA_UPGRADES = [
+    _likes_unique_pair,
+    _skips_unique_pair,
+    _matches_unique_pair,
+    _notifications_unread_index,
+    _messages_history_index,
+    _event_messages_history_index,
+    _notifications_feed_and_compaction,
+    _users_last_seen,
+    _notifications_message_groups_index,
+    _notifications_pending_message_unique,
+]
+
+
+# Thiếu các unique index này thì INSERT IGNORE / upsert lại ghi trùng like / skip / match / thông báo
+# → không cho khởi động
+REQUIRED_UPGRADES = {
+    _likes_unique_pair, _skips_unique_pair, _matches_unique_pair, _notifications_pending_message_unique,
+}
+
+
+def upgrade_schema(engine: Engine):
+    """Chạy từng bước nâng cấp; bước tuỳ chọn lỗi chỉ in cảnh báo, bước bắt buộc lỗi thì dừng khởi động"""
+    for step in SCHEMA_UPGRADES:
+        try:
+            with engine.begin() as conn:
+                step(conn)
+        except Exception as e:
+            if step in REQUIRED_UPGRADES:
+                raise RuntimeError(f"❌ Không thể nâng cấp schema ({step.__name__}): {e}") from e
+            print(f"⚠️ Không thể nâng cấp schema ({step.__name__}): {e}")
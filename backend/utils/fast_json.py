@@ -0,0 +1,33 @@
+import json
+
+# orjson nhanh hơn json chuẩn nhiều lần khi encode frame WebSocket; không cài thì dùng json
+try:
+    import orjson
+except ImportError:  # pragma: no cover - gói tuỳ chọn
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """Encode ra chuỗi JSON (str) để gửi qua WebSocket / broker"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def loads(data):
+    """Decode JSON từ str / bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_is_me_variants(message: dict) -> dict:
+    """
+    Tin chat chỉ có 2 biến thể (của mình / của người khác) → encode sẵn 1 lần ở nơi gửi.
+    Broker chỉ chuyển chuỗi đã encode, worker nhận không phải encode lại cho từng client.
+    """
+    return {
+        "sender_id": message["sender_id"],
+        "me": dumps({**message, "is_me": True}),
+        "other": dumps({**message, "is_me": False}),
+    }
@@ -1,9 +1,49 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+# Độ khó bcrypt (mỗi +1 → chậm gấp đôi). Đổi giá trị: hash cũ được băm lại lúc user đăng nhập.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt nhả GIL → thread chạy song song thật; giới hạn = số core để không chiếm CPU của API khác
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
 
 def get_password_hash(password: str):  # 🔁 đổi tên cho đúng
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
+
+
+# ----------------------------- #
+#  BẢN ASYNC: chạy trên pool bcrypt riêng (không chiếm threadpool của các API sync)
+# ----------------------------- #
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run(pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(đúng mật khẩu?, hash mới nếu hash cũ khác BCRYPT_ROUNDS cần băm lại, ngược lại None)"""
+    return await _run(pwd_context.verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,15 @@
+import unicodedata
+
+
+def clean_spaces(value: str) -> str:
+    """Bỏ khoảng trắng thừa ở đầu/cuối và giữa các từ"""
+    return " ".join(value.split())
+
+
+def normalize_text(value: str) -> str:
+    """Chuẩn hóa để so khớp: chữ thường, bỏ dấu tiếng Việt ("Hà Nội" → "ha noi")"""
+    if not value:
+        return ""
+    value = clean_spaces(value).lower().replace("đ", "d")
+    value = unicodedata.normalize("NFD", value)
+    return "".join(ch for ch in value if unicodedata.category(ch) != "Mn")
@@ -1,16 +1,47 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import get_db
+from database import run_in_session
 from auth.jwt_handler import verify_access_token
+from services.broker import broker
+from services.principal_cache import principal_cache
+from services.presence import presence
+from websocket.outbound import OutboundConnection
+from utils import fast_json
+from services import conversation_summary
 import json
-from datetime import datetime
 
 router = APIRouter(prefix="/ws", tags=["WebSocket Call"])
 
-# Lưu kết nối: user_id → WebSocket
-call_connections: Dict[int, WebSocket] = {}
+# Lưu kết nối: user_id → hàng đợi gửi của WebSocket (chỉ các user nối vào worker này)
+call_connections: Dict[int, OutboundConnection] = {}
+
+
+def call_channel(user_id: int) -> str:
+    return f"call:{user_id}"
+
+
+async def deliver_local(channel: str, message: dict):
+    """Nhận tín hiệu từ broker → đưa vào hàng đợi gửi của user nếu đang nối vào worker này"""
+    out = call_connections.get(int(channel.split(":", 1)[1]))
+    if out is not None:
+        out.offer(fast_json.dumps(message))
+
+
+async def remove_connection(user_id: int, out: OutboundConnection):
+    out.close()
+    # Chỉ xoá nếu chưa bị kết nối mới hơn của cùng user thay thế
+    if call_connections.get(user_id) is out:
+        del call_connections[user_id]
+        await broker.unsubscribe(call_channel(user_id), deliver_local)
+
+
+async def send_to_user(target_id: int, message: dict):
+    """Gửi tín hiệu (offer/answer/ICE...) tới user dù họ nối vào worker nào"""
+    if target_id is None:
+        return
+    await broker.publish(call_channel(target_id), message)
 
 # 👇 HÀM HỖ TRỢ: Lưu log vào bảng messages
 def save_call_log_message(db: Session, match_id: int, sender_id: int, content: str):
@@ -22,15 +53,52 @@ def save_call_log_message(db: Session, match_id: int, sender_id: int, content: s
             """),
             {"mid": match_id, "sid": sender_id, "content": content}
         )
+        conversation_summary.on_message(db, match_id, sender_id, content, "call_log")
         db.commit()
     except Exception as e:
         print(f"⚠️ Error saving call log: {e}")
 
+# ----------------------------- #
+#  TRUY VẤN DB (mỗi lần 1 Session ngắn qua run_in_session)
+# ----------------------------- #
+def create_call(db: Session, match_id: int, caller_id: int, callee_id: int, call_type: str) -> int:
+    result = db.execute(
+        text("""
+            INSERT INTO calls (match_id, caller_id, callee_id, call_type, status, started_at)
+            VALUES (:mid, :caller, :callee, :ctype, 'missed', NOW())
+        """),
+        {
+            "mid": match_id, "caller": caller_id, "callee": callee_id, "ctype": call_type
+        }
+    )
+    db.commit()
+    return result.lastrowid
+
+
+def set_call_status(db: Session, call_id: int, status: str):
+    db.execute(
+        text("UPDATE calls SET status = :status WHERE call_id = :cid"),
+        {"cid": call_id, "status": status}
+    )
+    db.commit()
+
+
+def end_call(db: Session, call_id: int, duration: int):
+    db.execute(
+        text("""
+            UPDATE calls 
+            SET status = 'ended', ended_at = NOW(), duration = :dur
+            WHERE call_id = :cid
+        """),
+        {"cid": call_id, "dur": duration}
+    )
+    db.commit()
+
+
 @router.websocket("/call/{match_id}")
 async def call_signaling(
     websocket: WebSocket, 
-    match_id: int, 
-    db: Session = Depends(get_db)
+    match_id: int
 ):
     token = websocket.query_params.get("token")
     if not token:
@@ -42,11 +110,7 @@ async def call_signaling(
         await websocket.close(code=403)
         return
 
-    email = payload.get("sub")
-    user = db.execute(
-        text("SELECT user_id, full_name FROM users WHERE email = :email"),
-        {"email": email}
-    ).fetchone()
+    user = await run_in_session(principal_cache.resolve, payload)
 
     if not user:
         await websocket.close(code=403)
@@ -55,12 +119,24 @@ async def call_signaling(
     user_id = user.user_id
     
     await websocket.accept()
-    call_connections[user_id] = websocket
+    if user_id not in call_connections:
+        await broker.subscribe(call_channel(user_id), deliver_local)
+    else:
+        call_connections[user_id].close()
+
+    async def evict(out: OutboundConnection):
+        await remove_connection(user_id, out)
+
+    out = OutboundConnection(websocket, user_id, on_evict=evict)
+    out.start()
+    call_connections[user_id] = out
+    presence.connect(user_id)
     print(f"📞 User {user_id} connected to call signaling")
 
     try:
         while True:
             data = await websocket.receive_text()
+            presence.heartbeat(user_id)
             message = json.loads(data)
             msg_type = message.get("type")
 
@@ -69,71 +145,48 @@ async def call_signaling(
                 target_id = message.get("target_id")
                 call_type = message.get("call_type", "voice")
                 
-                result = db.execute(
-                    text("""
-                        INSERT INTO calls (match_id, caller_id, callee_id, call_type, status, started_at)
-                        VALUES (:mid, :caller, :callee, :ctype, 'missed', NOW())
-                    """),
-                    {
-                        "mid": match_id, "caller": user_id, "callee": target_id, "ctype": call_type
-                    }
-                )
-                db.commit()
-                call_id = result.lastrowid
-
-                if target_id in call_connections:
-                    await call_connections[target_id].send_text(json.dumps({
-                        "type": "incoming-call",
-                        "call_id": call_id,
-                        "caller_id": user_id,
-                        "caller_name": user.full_name,
-                        "call_type": call_type,
-                        "offer": message.get("offer")
-                    }))
+                call_id = await run_in_session(create_call, match_id, user_id, target_id, call_type)
+
+                await send_to_user(target_id, {
+                    "type": "incoming-call",
+                    "call_id": call_id,
+                    "caller_id": user_id,
+                    "caller_name": user.full_name,
+                    "call_type": call_type,
+                    "offer": message.get("offer")
+                })
 
             # ✅ 2. Trả lời
             elif msg_type == "call-answer":
                 target_id = message.get("target_id")
                 call_id = message.get("call_id")
                 
-                db.execute(
-                    text("UPDATE calls SET status = 'answered' WHERE call_id = :cid"),
-                    {"cid": call_id}
-                )
-                db.commit()
-
-                if target_id in call_connections:
-                    await call_connections[target_id].send_text(json.dumps({
-                        "type": "call-answered",
-                        "answer": message.get("answer")
-                    }))
+                await run_in_session(set_call_status, call_id, "answered")
+
+                await send_to_user(target_id, {
+                    "type": "call-answered",
+                    "answer": message.get("answer")
+                })
 
             # ✅ 3. ICE Candidates
             elif msg_type == "ice-candidate":
                 target_id = message.get("target_id")
-                if target_id in call_connections:
-                    await call_connections[target_id].send_text(json.dumps({
-                        "type": "ice-candidate",
-                        "candidate": message.get("candidate")
-                    }))
+                await send_to_user(target_id, {
+                    "type": "ice-candidate",
+                    "candidate": message.get("candidate")
+                })
 
             # ✅ 4. Từ chối
             elif msg_type == "call-reject":
                 target_id = message.get("target_id")
                 call_id = message.get("call_id")
                 
-                db.execute(
-                    text("UPDATE calls SET status = 'rejected' WHERE call_id = :cid"),
-                    {"cid": call_id}
-                )
-                db.commit()
-                
-                save_call_log_message(db, match_id, user_id, "📞 Cuộc gọi bị từ chối")
+                await run_in_session(set_call_status, call_id, "rejected")
+                await run_in_session(save_call_log_message, match_id, user_id, "📞 Cuộc gọi bị từ chối")
 
-                if target_id in call_connections:
-                    await call_connections[target_id].send_text(json.dumps({
-                        "type": "call-rejected"
-                    }))
+                await send_to_user(target_id, {
+                    "type": "call-rejected"
+                })
 
             # ✅ 5. Kết thúc cuộc gọi (ĐÃ SỬA LOGIC TEXT)
             elif msg_type == "call-end":
@@ -143,15 +196,7 @@ async def call_signaling(
                 # 👇 Lấy call_type từ client gửi lên
                 call_type = message.get("call_type", "voice") 
                 
-                db.execute(
-                    text("""
-                        UPDATE calls 
-                        SET status = 'ended', ended_at = NOW(), duration = :dur
-                        WHERE call_id = :cid
-                    """),
-                    {"cid": call_id, "dur": duration}
-                )
-                db.commit()
+                await run_in_session(end_call, call_id, duration)
                 
                 # 👇 Tạo nội dung log dựa trên loại cuộc gọi
                 mins, secs = divmod(int(duration), 60)
@@ -162,15 +207,17 @@ async def call_signaling(
                 else:
                     log_content = f"📞 Cuộc gọi thoại - {time_str}"
                 
-                save_call_log_message(db, match_id, user_id, log_content)
+                await run_in_session(save_call_log_message, match_id, user_id, log_content)
 
-                if target_id in call_connections:
-                    await call_connections[target_id].send_text(json.dumps({
-                        "type": "call-ended",
-                        "call_type": call_type # Gửi lại type cho bên kia biết
-                    }))
+                await send_to_user(target_id, {
+                    "type": "call-ended",
+                    "call_type": call_type # Gửi lại type cho bên kia biết
+                })
 
     except WebSocketDisconnect:
-        if user_id in call_connections:
-            del call_connections[user_id]
-        print(f"📵 User {user_id} disconnected from call")
\ No newline at end of file
+        print(f"📵 User {user_id} disconnected from call")
+    except Exception as e:
+        print(f"Call WS error: {e}")
+    finally:
+        await remove_connection(user_id, out)
+        presence.disconnect(user_id)
\ No newline at end of file
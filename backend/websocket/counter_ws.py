@@ -0,0 +1,119 @@
+import uuid
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Dict, List
+from database import run_in_session
+from auth.jwt_handler import verify_access_token
+from services.broker import broker
+from services.principal_cache import principal_cache
+from services.presence import presence
+from services.unread_counters import unread_counters
+from websocket.outbound import OutboundConnection
+from utils import fast_json
+
+router = APIRouter(prefix="/ws", tags=["WebSocket Counters"])
+
+# Phân biệt worker gửi delta (worker gửi đã tự cộng vào cache của mình)
+WORKER_ID = uuid.uuid4().hex
+
+# user_id → list[OutboundConnection] (1 user có thể mở nhiều tab)
+counter_connections: Dict[int, List[OutboundConnection]] = {}
+
+
+def counters_channel(user_id: int) -> str:
+    return f"counters:{user_id}"
+
+
+async def deliver_local(channel: str, frame: dict):
+    user_id = int(channel.split(":", 1)[1])
+    conns = counter_connections.get(user_id)
+    if not conns:
+        return
+    if frame.get("type") == "delta":
+        # Tin từ worker khác: cộng vào cache của worker này (worker gửi đã tự cộng vào cache của nó)
+        if frame.get("origin") != WORKER_ID:
+            unread_counters.on_delta(user_id, frame["messages"], frame["notifications"])
+        counters = unread_counters.peek(user_id)
+        if counters is None:  # Cache hết hạn → đếm lại từ DB (tối đa 1 lần / TTL cho user đang mở socket)
+            counters = await run_in_session(unread_counters.get, user_id)
+        frame = {"type": "counters", **counters}
+    encoded = fast_json.dumps(frame)
+    for out in conns:
+        out.offer(encoded)
+
+
+async def remove_connection(user_id: int, out: OutboundConnection):
+    out.close()
+    conns = counter_connections.get(user_id, [])
+    if out in conns:
+        conns.remove(out)
+    if not conns and counter_connections.pop(user_id, None) is not None:
+        await broker.unsubscribe(counters_channel(user_id), deliver_local)
+
+
+async def push_counters(user_id: int):
+    """Đọc lại số đếm và gửi frame "counters" tới mọi kết nối của user (ở mọi worker, qua broker)"""
+    if not broker.has_subscribers(counters_channel(user_id)):
+        return
+    counters = await run_in_session(unread_counters.get, user_id)
+    await broker.publish(counters_channel(user_id), {"type": "counters", **counters})
+
+
+async def push_counter_delta(user_id: int, messages: int = 0, notifications: int = 0):
+    """
+    Gọi sau khi đã cộng unread_counters ở worker này: chỉ gửi phần thay đổi, không đọc DB.
+    Không ai mở kết nối counters → không publish gì.
+    """
+    if not (messages or notifications) or not broker.has_subscribers(counters_channel(user_id)):
+        return
+    await broker.publish(counters_channel(user_id), {
+        "type": "delta", "origin": WORKER_ID, "messages": messages, "notifications": notifications,
+    })
+
+
+@router.websocket("/counters")
+async def counters_ws(websocket: WebSocket):
+    token = websocket.query_params.get("token")
+    if not token:
+        await websocket.close(code=4001)
+        return
+
+    payload = verify_access_token(token)
+    if not payload:
+        await websocket.close(code=403)
+        return
+
+    user = await run_in_session(principal_cache.resolve, payload)
+    if not user:
+        await websocket.close(code=403)
+        return
+
+    user_id = user.user_id
+    await websocket.accept()
+    if user_id not in counter_connections:
+        await broker.subscribe(counters_channel(user_id), deliver_local)
+
+    async def evict(out: OutboundConnection):
+        await remove_connection(user_id, out)
+
+    out = OutboundConnection(websocket, user_id, on_evict=evict)
+    counter_connections.setdefault(user_id, []).append(out)
+    presence.connect(user_id)
+
+    try:
+        # Gửi ngay giá trị hiện tại, sau đó chỉ đẩy khi có thay đổi
+        counters = await run_in_session(unread_counters.get, user_id)
+        await websocket.send_text(fast_json.dumps({"type": "counters", **counters}))
+        out.start()
+        while True:
+            # Client có thể gửi "refresh" để lấy lại giá trị
+            frame = await websocket.receive_text()
+            presence.heartbeat(user_id)
+            if frame == "refresh":
+                await push_counters(user_id)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Counter WS error: {e}")
+    finally:
+        await remove_connection(user_id, out)
+        presence.disconnect(user_id)
@@ -1,30 +1,106 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict, List
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import get_db
+from database import run_in_session
 from auth.jwt_handler import verify_access_token
 import json
 from datetime import datetime
 from models.event_message_model import EventMessage # 👈 Import Model tin nhắn
+from services import event_chat_history
+from services.broker import broker
+from services.principal_cache import principal_cache
+from services.presence import presence
+from services.write_behind import WRITE_BEHIND_ENABLED, WriteBehindBuffer
+from websocket.outbound import OutboundConnection
+from utils import fast_json
+from utils.fast_json import encode_is_me_variants
 
 router = APIRouter(prefix="/ws", tags=["Event Chat"])
 
-# Lưu kết nối: event_id -> List[{ws, user_id, full_name}]
+# Lưu kết nối: event_id -> List[{ws, user_id, full_name, out}]
 event_connections: Dict[int, List[dict]] = {}
 
+def event_channel(event_id: int) -> str:
+    return f"event:{event_id}"
+
+
+async def deliver_local(channel: str, message: dict):
+    """Nhận tin từ broker → đưa vào hàng đợi gửi của các client của sự kiện ở worker này"""
+    event_id = int(channel.split(":", 1)[1])
+    conns = event_connections.get(event_id)
+    if not conns:
+        return
+    # message = 2 frame (me/other) đã encode sẵn ở nơi gửi → phòng 500 người vẫn chỉ encode 2 lần
+    for conn in conns:
+        conn["out"].offer(message["me"] if conn["user_id"] == message["sender_id"] else message["other"])
+
+
 async def broadcast_event_message(event_id: int, message: dict):
+    await broker.publish(event_channel(event_id), encode_is_me_variants(message))
+
+
+async def remove_connection(event_id: int, websocket: WebSocket):
     if event_id in event_connections:
-        for conn in event_connections[event_id]:
-            try:
-                # Đánh dấu tin nhắn của chính mình để frontend hiển thị (me/other)
-                msg_to_send = {**message, "is_me": conn["user_id"] == message["sender_id"]}
-                await conn["ws"].send_text(json.dumps(msg_to_send))
-            except:
-                pass
+        remaining = []
+        for c in event_connections[event_id]:
+            if c["ws"] is websocket:
+                c["out"].close()
+            else:
+                remaining.append(c)
+        event_connections[event_id] = remaining
+        if not remaining:
+            del event_connections[event_id]
+            await broker.unsubscribe(event_channel(event_id), deliver_local)
+
+# ----------------------------- #
+#  TRUY VẤN DB (mỗi lần 1 Session ngắn qua run_in_session)
+# ----------------------------- #
+def load_event_member(db: Session, token_payload: dict, event_id: int):
+    """User nếu được vào phòng chat (đã tham gia sự kiện hoặc là Admin), ngược lại None"""
+    user = principal_cache.resolve(db, token_payload)
+    if not user:
+        return None
+
+    if user.role != 'admin':
+        is_joined = db.execute(text("SELECT 1 FROM event_participants WHERE event_id=:eid AND user_id=:uid"), 
+                               {"eid": event_id, "uid": user.user_id}).fetchone()
+        if not is_joined:
+            return None
+    return user
+
+
+def save_event_message(db: Session, event_id: int, sender_id: int, content: str) -> int:
+    new_msg = EventMessage(
+        event_id=event_id,
+        sender_id=sender_id,
+        content=content,
+        type="text"
+    )
+    db.add(new_msg)
+    db.commit() # Commit để lưu và lấy id
+    return new_msg.id
+
+
+def save_event_messages_batch(db: Session, rows: List[dict]):
+    """Chế độ ghi sau: 1 câu INSERT nhiều dòng cho cả lô"""
+    db.execute(
+        EventMessage.__table__.insert(),
+        [{**r, "type": "text"} for r in rows],
+    )
+    db.commit()
+
+
+async def flush_event_messages(rows: List[dict]):
+    await run_in_session(save_event_messages_batch, rows)
+
+
+# Chỉ dùng khi bật CHAT_WRITE_BEHIND=1
+event_message_buffer = WriteBehindBuffer("event_messages", flush_event_messages)
+
 
 @router.websocket("/event-chat/{event_id}")
-async def event_chat_endpoint(websocket: WebSocket, event_id: int, db: Session = Depends(get_db)):
+async def event_chat_endpoint(websocket: WebSocket, event_id: int):
     # 1. Xác thực Token
     token = websocket.query_params.get("token")
     if not token:
@@ -36,59 +112,76 @@ async def event_chat_endpoint(websocket: WebSocket, event_id: int, db: Session =
         await websocket.close(code=4003)
         return
 
-    email = payload.get("sub")
-    user = db.execute(text("SELECT user_id, full_name, role FROM users WHERE email=:e"), {"e": email}).fetchone()
-    
+    # 2. Kiểm tra quyền: Phải tham gia sự kiện hoặc là Admin
+    user = await run_in_session(load_event_member, payload, event_id)
     if not user:
         await websocket.close(code=4003)
         return
 
-    # 2. Kiểm tra quyền: Phải tham gia sự kiện hoặc là Admin
-    if user.role != 'admin':
-        is_joined = db.execute(text("SELECT 1 FROM event_participants WHERE event_id=:eid AND user_id=:uid"), 
-                               {"eid": event_id, "uid": user.user_id}).fetchone()
-        if not is_joined:
-            await websocket.close(code=4003)
-            return
-
     # 3. Chấp nhận kết nối
     await websocket.accept()
     
     if event_id not in event_connections:
         event_connections[event_id] = []
+        await broker.subscribe(event_channel(event_id), deliver_local)
     
+    async def evict(out: OutboundConnection):
+        await remove_connection(event_id, websocket)
+
+    out = OutboundConnection(websocket, user.user_id, on_evict=evict)
     event_connections[event_id].append({
         "ws": websocket, 
         "user_id": user.user_id,
-        "full_name": user.full_name
+        "full_name": user.full_name,
+        "out": out,
     })
 
+    presence.connect(user.user_id)
+
     try:
+        # ✅ Kết nối lại với ?since=<id cuối đã nhận> → chỉ gửi bù các tin bị lỡ
+        # (nằm trong try: client rớt / DB lỗi lúc gửi bù vẫn được dọn ở finally)
+        since = websocket.query_params.get("since")
+        if since and since.isdigit():
+            missed, has_more = await run_in_session(event_chat_history.fetch_since, event_id, int(since),
+                                                    event_chat_history.MAX_REPLAY)
+            for m in missed:
+                await websocket.send_text(fast_json.dumps(event_chat_history.format_message(m, user.user_id)))
+            if has_more:
+                # Quá nhiều tin bị lỡ → client tự tải thêm qua GET /events/{id}/messages?since=
+                await websocket.send_text(fast_json.dumps({"type": "replay_truncated", "last_id": missed[-1].id}))
+        # Tin mới đến trong lúc gửi bù đã nằm chờ trong hàng đợi → bật task ghi sau khi gửi bù xong
+        out.start()
+
         while True:
             data = await websocket.receive_text()
+            presence.heartbeat(user.user_id)
             payload = json.loads(data)
             content = payload.get("content", "").strip()
             
             if not content: continue
 
             # ✅ A. LƯU TIN NHẮN VÀO DATABASE
-            new_msg = EventMessage(
-                event_id=event_id,
-                sender_id=user.user_id,
-                content=content,
-                type="text"
-            )
-            db.add(new_msg)
-            db.commit() # Commit để lưu và lấy thời gian tạo (created_at)
+            now = datetime.now()
+            if WRITE_BEHIND_ENABLED:
+                # Ghi theo lô ở nền → chưa có id: client giữ id cuối đã biết để ?since gửi bù
+                msg_id = None
+                event_message_buffer.append({
+                    "event_id": event_id, "sender_id": user.user_id,
+                    "content": content, "created_at": now,
+                })
+            else:
+                msg_id = await run_in_session(save_event_message, event_id, user.user_id, content)
 
             # ✅ B. CHUẨN BỊ DỮ LIỆU GỬI ĐI
             message_data = {
+                "id": msg_id,
                 "type": "text",
                 "content": content,
                 "sender_id": user.user_id,
                 "sender_name": user.full_name,
                 # Format giờ phút (HH:MM)
-                "created_at": datetime.now().strftime("%H:%M"), 
+                "created_at": now.strftime("%H:%M"), 
                 "avatar": "" 
             }
 
@@ -96,7 +189,9 @@ async def event_chat_endpoint(websocket: WebSocket, event_id: int, db: Session =
             await broadcast_event_message(event_id, message_data)
 
     except WebSocketDisconnect:
-        if event_id in event_connections:
-            event_connections[event_id] = [c for c in event_connections[event_id] if c["ws"] != websocket]
+        pass
     except Exception as e:
-        print(f"Error event chat: {e}")
\ No newline at end of file
+        print(f"Error event chat: {e}")
+    finally:
+        await remove_connection(event_id, websocket)
+        presence.disconnect(user.user_id)
\ No newline at end of file
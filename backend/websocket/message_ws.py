@@ -1,16 +1,30 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict, List
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import get_db
+from database import run_in_session
 from auth.jwt_handler import verify_access_token
+from services import conversation_summary
+from services.broker import broker
+from services.principal_cache import principal_cache
+from services.presence import presence
+from services.notification_coalescer import coalesce_message_notification
+from services.unread_counters import unread_counters
+from services.write_behind import WRITE_BEHIND_ENABLED, WriteBehindBuffer
+from websocket.counter_ws import push_counter_delta
+from websocket.outbound import OutboundConnection
+from utils.fast_json import encode_is_me_variants
 import json
 
 router = APIRouter(prefix="/ws", tags=["WebSocket Chat"])
 
-# match_id → list[{"ws": WebSocket, "user_id": int}]
+# match_id → list[{"ws": WebSocket, "user_id": int, "out": OutboundConnection}]
 active_connections: Dict[int, List[dict]] = {}
 
+def chat_channel(match_id: int) -> str:
+    return f"chat:{match_id}"
+
+
 # ----------------------------- #
 #  KẾT NỐI / NGẮT KẾT NỐI
 # ----------------------------- #
@@ -19,60 +33,148 @@ async def connect_client(match_id: int, websocket: WebSocket, user_id: int):
     await websocket.accept()
     if match_id not in active_connections:
         active_connections[match_id] = []
-    active_connections[match_id].append({"ws": websocket, "user_id": user_id})
+        # Client đầu tiên của match ở worker này → nghe kênh của match trên broker
+        await broker.subscribe(chat_channel(match_id), deliver_local)
+
+    async def evict(out: OutboundConnection):
+        await remove_client(match_id, websocket)
+
+    out = OutboundConnection(websocket, user_id, on_evict=evict)
+    out.start()
+    active_connections[match_id].append({"ws": websocket, "user_id": user_id, "out": out})
     print(f"🔌 Client {user_id} joined match {match_id}. Total: {len(active_connections[match_id])}")
 
 
-def remove_client(match_id: int, websocket: WebSocket):
-    """Xoá client khi ngắt kết nối"""
+async def remove_client(match_id: int, websocket: WebSocket):
+    """Xoá client khi ngắt kết nối (hoặc bị ngắt vì nhận quá chậm)"""
     if match_id in active_connections:
-        active_connections[match_id] = [
-            c for c in active_connections[match_id] if c["ws"] != websocket
-        ]
-        if not active_connections[match_id]:
+        remaining = []
+        for c in active_connections[match_id]:
+            if c["ws"] is websocket:
+                c["out"].close()
+            else:
+                remaining.append(c)
+        active_connections[match_id] = remaining
+        if not remaining:
             del active_connections[match_id]
+            await broker.unsubscribe(chat_channel(match_id), deliver_local)
     print(f"❌ Client left match {match_id}")
 
 
+async def deliver_local(channel: str, message: dict):
+    """Nhận tin từ broker → đưa vào hàng đợi gửi của các client của match ở worker này"""
+    match_id = int(channel.split(":", 1)[1])
+    conns = active_connections.get(match_id)
+    if not conns:
+        return
+    # message = 2 frame đã encode sẵn ở nơi gửi (encode_is_me_variants) → chỉ việc xếp hàng
+    for conn in conns:
+        conn["out"].offer(message["me"] if conn["user_id"] == message["sender_id"] else message["other"])
+
+
 async def broadcast_message(match_id: int, message: dict):
-    """Gửi tin nhắn tới tất cả client trong match"""
-    if match_id in active_connections:
-        for conn in active_connections[match_id]:
-            try:
-                # Gắn cờ "is_me" để phân biệt bên gửi / nhận
-                message["is_me"] = conn["user_id"] == message["sender_id"]
-                await conn["ws"].send_text(json.dumps(message))
-            except Exception as e:
-                print(f"⚠️ Send error: {e}")
-
-# 👇 HÀM TẠO THÔNG BÁO (MỚI)
-def create_message_notification(db: Session, sender_id: int, receiver_id: int, content: str):
+    """Gửi tin nhắn tới tất cả client trong match (mọi worker, qua broker)"""
+    await broker.publish(chat_channel(match_id), encode_is_me_variants(message))
+
+
+def is_in_chat(match_id: int, user_id: int) -> bool:
+    """User đang mở socket của match này → đã thấy tin realtime, không cần thông báo
+    (chỉ biết kết nối ở worker này; ở worker khác thì vẫn tạo thông báo như cũ)"""
+    return any(c["user_id"] == user_id for c in active_connections.get(match_id, []))
+
+
+# ----------------------------- #
+#  TRUY VẤN DB (mỗi lần 1 Session ngắn qua run_in_session)
+# ----------------------------- #
+def load_chat_context(db: Session, token_payload: dict, match_id: int):
+    """Trả về (user, partner_id) hoặc (None, close_code) nếu không được vào"""
+    user = principal_cache.resolve(db, token_payload)
+    if not user:
+        return None, 403
+
+    # ✅ Tìm người nhận (Partner ID) để gửi thông báo
+    match_info = db.execute(
+        text("SELECT user1_id, user2_id FROM matches WHERE match_id = :mid"),
+        {"mid": match_id}
+    ).fetchone()
+    if not match_info:
+        return None, 4004
+
+    partner_id = match_info.user2_id if match_info.user1_id == user.user_id else match_info.user1_id
+    return user, partner_id
+
+
+def save_message(db: Session, match_id: int, sender_id: int, partner_id: int,
+                 content: str, msg_type: str, notify: bool, seen: bool = False) -> bool:
+    """Lưu tin + summary + thông báo gộp trong 1 transaction; True nếu tạo thông báo mới.
+    seen: người nhận đang mở khung chat → lưu tin là đã đọc, không tăng số chưa đọc"""
+    db.execute(
+        text("""
+            INSERT INTO messages (match_id, sender_id, content, type, is_read)
+            VALUES (:mid, :sid, :content, :type, :read)
+        """),
+        {"mid": match_id, "sid": sender_id, "content": content, "type": msg_type, "read": int(seen)},
+    )
+    conversation_summary.on_message(db, match_id, sender_id, content, msg_type, receiver_active=seen)
+    notified = notify and notify_partner(db, sender_id, partner_id, content)
+    db.commit()
+    return notified
+
+
+def notify_partner(db: Session, sender_id: int, partner_id: int, content: str) -> bool:
+    """Thông báo cho người nhận, gộp thành "N tin nhắn mới"; True nếu tạo dòng thông báo mới"""
     try:
-        # Tạo nội dung ngắn gọn
-        preview = content[:30] + "..." if len(content) > 30 else content
-        notif_content = f"📩 Bạn có tin nhắn mới: {preview}"
-        
-        db.execute(
-            text("""
-                INSERT INTO notifications (user_id, from_user_id, type, content, created_at)
-                VALUES (:uid, :from_id, 'message', :content, NOW())
-            """),
-            {
-                "uid": receiver_id,       
-                "from_id": sender_id,     
-                "content": notif_content
-            }
-        )
-        db.commit()
+        # Savepoint: lỗi thông báo không làm mất tin nhắn
+        with db.begin_nested():
+            return coalesce_message_notification(db, sender_id, partner_id, content)
     except Exception as e:
         print(f"⚠️ Lỗi tạo thông báo: {e}")
+        return False
+
+
+def save_messages_batch(db: Session, rows: List[dict]) -> List[int]:
+    """Chế độ ghi sau: INSERT nhiều dòng 1 lần + summary/thông báo cho cả lô, 1 commit.
+    Trả về các user vừa có thông báo mới."""
+    values, params = [], {}
+    for i, r in enumerate(rows):
+        values.append(f"(:mid{i}, :sid{i}, :content{i}, :type{i}, :at{i}, :read{i})")
+        params.update({
+            f"mid{i}": r["match_id"], f"sid{i}": r["sender_id"],
+            f"content{i}": r["content"], f"type{i}": r["type"], f"at{i}": r["created_at"],
+            f"read{i}": int(r.get("seen", False)),
+        })
+    db.execute(text(
+        "INSERT INTO messages (match_id, sender_id, content, type, created_at, is_read) VALUES "
+        + ", ".join(values)
+    ), params)
+
+    notified = []
+    for r in rows:
+        conversation_summary.on_message(db, r["match_id"], r["sender_id"], r["content"], r["type"],
+                                        receiver_active=r.get("seen", False))
+        if r["notify"] and notify_partner(db, r["sender_id"], r["partner_id"], r["content"]):
+            notified.append(r["partner_id"])
+    db.commit()
+    return notified
+
+
+async def flush_messages(rows: List[dict]):
+    notified = await run_in_session(save_messages_batch, rows)
+    if notified:
+        unread_counters.on_notifications(notified)
+        for uid in set(notified):
+            await push_counter_delta(uid, notifications=notified.count(uid))
+
+
+# Chỉ dùng khi bật CHAT_WRITE_BEHIND=1
+message_buffer = WriteBehindBuffer("messages", flush_messages)
 
 
 # ----------------------------- #
 #  ROUTE WEBSOCKET CHÍNH
 # ----------------------------- #
 @router.websocket("/chat/{match_id}")
-async def chat_ws(websocket: WebSocket, match_id: int, db: Session = Depends(get_db)):
+async def chat_ws(websocket: WebSocket, match_id: int):
     # ✅ Lấy token
     token = websocket.query_params.get("token")
     if not token:
@@ -85,34 +187,19 @@ async def chat_ws(websocket: WebSocket, match_id: int, db: Session = Depends(get
         await websocket.close(code=403)
         return
 
-    email = payload.get("sub")
-    user = db.execute(
-        text("SELECT user_id, full_name FROM users WHERE email = :email"),
-        {"email": email},
-    ).fetchone()
-
+    user, partner_id = await run_in_session(load_chat_context, payload, match_id)
     if not user:
-        await websocket.close(code=403)
+        await websocket.close(code=partner_id)
         return
 
-    # ✅ Tìm người nhận (Partner ID) để gửi thông báo
-    match_info = db.execute(
-        text("SELECT user1_id, user2_id FROM matches WHERE match_id = :mid"),
-        {"mid": match_id}
-    ).fetchone()
-    
-    if not match_info:
-        await websocket.close(code=4004)
-        return
-
-    partner_id = match_info.user2_id if match_info.user1_id == user.user_id else match_info.user1_id
-
     # ✅ Cho phép kết nối
     await connect_client(match_id, websocket, user.user_id)
+    presence.connect(user.user_id)
 
     try:
         while True:
             data = await websocket.receive_text()
+            presence.heartbeat(user.user_id)
             payload = json.loads(data)
             content = payload.get("content", "").strip()
             msg_type = payload.get("type", "text")
@@ -120,20 +207,28 @@ async def chat_ws(websocket: WebSocket, match_id: int, db: Session = Depends(get
             if not content:
                 continue
 
-            # ✅ 1. Lưu tin nhắn vào DB
-            db.execute(
-                text("""
-                    INSERT INTO messages (match_id, sender_id, content, type)
-                    VALUES (:mid, :sid, :content, :type)
-                """),
-                {"mid": match_id, "sid": user.user_id, "content": content, "type": msg_type},
-            )
-            db.commit()
-
-            # ✅ 2. Tạo thông báo cho người nhận (MỚI)
-            # (Chỉ tạo nếu là tin nhắn thường, không phải log hệ thống)
-            if msg_type != "call_log":
-                create_message_notification(db, user.user_id, partner_id, content)
+            # ✅ 1 + 2. Lưu tin nhắn + thông báo (bỏ qua log cuộc gọi và khi người nhận đang mở khung chat này)
+            # Người nhận đang mở khung chat → tin đã xem realtime: lưu là đã đọc, không tăng badge
+            seen = is_in_chat(match_id, partner_id)
+            notify = msg_type != "call_log" and not seen
+            now = datetime.now()
+            notified = False
+            if WRITE_BEHIND_ENABLED:
+                # Gửi realtime ngay, ghi DB theo lô (thông báo được đếm khi lô ghi xong)
+                message_buffer.append({
+                    "match_id": match_id, "sender_id": user.user_id, "partner_id": partner_id,
+                    "content": content, "type": msg_type, "created_at": now,
+                    "notify": notify, "seen": seen,
+                })
+            else:
+                notified = await run_in_session(save_message, match_id, user.user_id, partner_id,
+                                                content, msg_type, notify, seen)
+
+            unread = not seen and msg_type not in conversation_summary.NOT_UNREAD_TYPES
+            if unread:
+                unread_counters.on_message(partner_id)
+            if notified:
+                unread_counters.on_notifications([partner_id])
 
             # ✅ 3. Gửi realtime
             message_data = {
@@ -141,13 +236,18 @@ async def chat_ws(websocket: WebSocket, match_id: int, db: Session = Depends(get
                 "sender_name": user.full_name,
                 "content": content,
                 "type": msg_type,
-                "created_at": str(datetime.now()) # Thêm thời gian cho chuẩn
+                "created_at": str(now) # Thêm thời gian cho chuẩn
             }
             await broadcast_message(match_id, message_data)
 
+            # ✅ 4. Cập nhật badge của người nhận (nếu đang mở kết nối counters)
+            await push_counter_delta(partner_id, messages=int(unread), notifications=int(notified))
+
     except WebSocketDisconnect:
-        remove_client(match_id, websocket)
+        await remove_client(match_id, websocket)
     except Exception as e:
         print(f"Error: {e}")
-        remove_client(match_id, websocket)
-from datetime import datetime # Import thêm cái này ở đầu file nếu thiếu
\ No newline at end of file
+        await remove_client(match_id, websocket)
+    finally:
+        presence.disconnect(user.user_id)
+from datetime import datetime # Import thêm cái này ở đầu file nếu thiếu
@@ -0,0 +1,92 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from fastapi import WebSocket
+
+# ===============================
+# ⚙️ CẤU HÌNH
+# ===============================
+OUTBOUND_QUEUE_SIZE = 256      # Số frame tối đa chờ gửi cho 1 client
+SEND_TIMEOUT_SECONDS = 10      # 1 lần send quá lâu → coi như client treo
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try Again Later": client tự kết nối lại và tải bù
+
+
+def _send_timeout():
+    # asyncio.timeout (3.11+) không tạo task mới cho mỗi lần gửi như wait_for
+    if hasattr(asyncio, "timeout"):
+        return asyncio.timeout(SEND_TIMEOUT_SECONDS)
+    return _NoTimeout()
+
+
+class _NoTimeout:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class OutboundConnection:
+    """
+    Hàng đợi gửi riêng cho 1 WebSocket + 1 task ghi.
+    Broadcast chỉ offer() (không await) nên 1 client chậm không làm chậm cả phòng;
+    hàng đợi đầy / gửi lỗi → ngắt client đó (gọi on_evict để xoá khỏi danh sách).
+    """
+
+    def __init__(self, ws: WebSocket, user_id: int,
+                 on_evict: Optional[Callable[["OutboundConnection"], Awaitable[None]]] = None,
+                 max_queue: int = OUTBOUND_QUEUE_SIZE):
+        self.ws = ws
+        self.user_id = user_id
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_queue)
+        self._on_evict = on_evict
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def offer(self, frame: str) -> bool:
+        """Đưa frame vào hàng đợi; False nếu client đã bị ngắt vì quá chậm"""
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            print(f"🐢 Slow consumer (user {self.user_id}), closing")
+            self._start_evict()
+            return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                async with _send_timeout():
+                    await self.ws.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Send error (user {self.user_id}): {e}")
+            self._start_evict()
+
+    def _start_evict(self):
+        if self.closed:
+            return
+        self.closed = True
+        asyncio.create_task(self._evict())
+
+    async def _evict(self):
+        self.close()
+        try:
+            await self.ws.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+        if self._on_evict is not None:
+            await self._on_evict(self)
+
+    def close(self):
+        """Dừng task ghi (gọi khi client ngắt kết nối bình thường)"""
+        self.closed = True
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()